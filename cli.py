@@ -1,7 +1,10 @@
-import sys, readline, inspect
+import sys, readline, inspect, shutil
 from cpu import *
 from cpu_constants import *
 
+# Printable ASCII is shown as is in hexdumps, everything else as '.'
+ASCII = bytes(b if 0x20 <= b < 0x7F else ord('.') for b in range(256))
+
 class CLI():
     """Provides a command line interface for 6502 self.cpu"""
 
@@ -12,11 +15,16 @@ class CLI():
         self.cli_funcs = {
             'state': self.print_state, 'status': self.print_status,
             'history': self.print_history, 'mem': self.print_memory,
-            'help': self.print_help, 'exit': self.exit
+            'find': self.find_memory, 'fill': self.fill_memory,
+            'load': self.load_memory, 'help': self.print_help,
+            'exit': self.exit
         }
 
-        self.cmds = ['state', 'status',
-        'history', 'mem', 'exit'] + [i.lower() for i in instr_names]
+        self.cmds = ['state', 'status', 'history', 'mem', 'find', 'fill',
+        'load', 'exit'] + [i.lower() for i in instr_names]
+
+        # Long output is paged when a person is at the terminal
+        self.paging = sys.stdin.isatty() and sys.stdout.isatty()
 
         readline.set_completer(self.completer)
         readline.parse_and_bind("tab: complete")
@@ -94,12 +102,97 @@ class CLI():
             print(cmd)
 
     def print_memory(self, inp):
-        """Prints a segment of memory"""
+        """Prints a byte, or a hexdump of a range: mem START [END]"""
         try:
-            print(hex(self.cpu.memory[int(inp[1], 16)]))
-        except:
+            start = parse_address(inp[1])
+            if len(inp) < 3:
+                print(hex(self.cpu.memory[start]))
+                return
+            end = parse_address(inp[2])
+        except (IndexError, ValueError):
             print("Error: memory location out of range")
-            raise
+            return
+        if end < start:
+            print("Error: END must not be before START")
+            return
+
+        view = memoryview(self.cpu.memory)
+        lines = []
+        for row in range(start, end + 1, 16):
+            data = view[row:min(row + 16, end + 1)]
+            lines.append("%04x  %-47s  %s" % (row, data.hex(' '),
+                                              bytes(data).translate(ASCII).decode()))
+        self.page(lines)
+
+    def find_memory(self, inp):
+        """Prints the addresses where a byte pattern occurs: find PATTERN"""
+        try:
+            pattern = bytes.fromhex("".join(inp[1:]).replace("$", ""))
+            if not pattern:
+                raise ValueError
+        except ValueError:
+            print("Error: pattern must be hex bytes, e.g. find a9 00")
+            return
+
+        data = bytes(memoryview(self.cpu.memory))
+        matches = []
+        address = data.find(pattern)
+        while address != -1:
+            matches.append("%04x" % address)
+            address = data.find(pattern, address + 1)
+        if matches:
+            print("%d matches" % len(matches))
+            self.page([" ".join(matches[i:i + 8])
+                       for i in range(0, len(matches), 8)])
+        else:
+            print("Pattern not found")
+
+    def fill_memory(self, inp):
+        """Sets a range of memory to one byte: fill START END BYTE"""
+        try:
+            start = parse_address(inp[1])
+            end = parse_address(inp[2])
+            value = int(inp[3].replace("$", ""), 16)
+            if not start <= end or not 0 <= value <= 0xFF:
+                raise ValueError
+        except (IndexError, ValueError):
+            print("Error: expected fill START END BYTE")
+            return
+
+        memoryview(self.cpu.memory)[start:end + 1] = \
+            bytes([value]) * (end + 1 - start)
+
+    def load_memory(self, inp):
+        """Copies a file into memory: load FILE ADDR"""
+        try:
+            address = parse_address(inp[2])
+            with open(inp[1], "rb") as f:
+                data = f.read()
+        except (IndexError, ValueError):
+            print("Error: expected load FILE ADDR")
+            return
+        except OSError as e:
+            print("Error: %s" % e.strerror)
+            return
+
+        if address + len(data) > len(self.cpu.memory):
+            print("Error: %d bytes do not fit at %04x" % (len(data), address))
+            return
+        memoryview(self.cpu.memory)[address:address + len(data)] = data
+        print("Loaded %d bytes at %04x" % (len(data), address))
+
+    def page(self, lines):
+        """Prints lines, pausing after each screenful when interactive"""
+        if not self.paging:
+            print("\n".join(lines))
+            return
+
+        height = max(shutil.get_terminal_size().lines - 1, 1)
+        for i in range(0, len(lines), height):
+            print("\n".join(lines[i:i + height]))
+            if i + height < len(lines):
+                if input("-- more -- (q to stop) ").strip().lower() == "q":
+                    break
 
     def print_help(self, inp):
         """Prints the docstring for instruction(s), arguments"""
@@ -121,3 +214,11 @@ class CLI():
     def exit(self, inp):
         """Quits Virtual6502"""
         sys.exit()
+
+
+def parse_address(text):
+    """Parses a hex address such as c000 or $C000 and checks its range"""
+    address = int(text.replace("$", ""), 16)
+    if not 0 <= address <= 0xFFFF:
+        raise ValueError("Address out of range")
+    return address
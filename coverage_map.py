@@ -0,0 +1,159 @@
+"""Records which instructions a program executed and which way each branch
+went, for triaging ROM tests.
+
+Coverage is kept as three bitmaps with one bit per address: executed
+instructions, taken branches and branches that fell through. It is opt-in:
+attaching a CoverageMap to a CPU wraps that CPU's step, which CPU.run and
+any other driver call for every instruction, and CPUs without coverage run
+exactly as before.
+
+Usage: python3 coverage_map.py ROM [STEPS] [OUTPUT]   runs a ROM from $C000
+and writes OUTPUT.cov (the bitmaps) and OUTPUT.lst (an annotated listing)"""
+import sys
+from cpu import *
+from cpu_constants import *
+
+MAGIC = b'V6502COV'
+MAP_SIZE = 65536 // 8
+
+BRANCHES = frozenset((0x10, 0x30, 0x50, 0x70, 0x90, 0xB0, 0xD0, 0xF0))
+
+
+def check_address(bitmap, address):
+    """Checks if the bit for an address is set in a bitmap"""
+    return bitmap[address >> 3] & (1 << (address & 7))
+
+
+class CoverageMap():
+    """Bitmaps of executed addresses and branch outcomes"""
+    def __init__(self):
+        self.executed  = bytearray(MAP_SIZE)
+        self.taken     = bytearray(MAP_SIZE)
+        self.not_taken = bytearray(MAP_SIZE)
+        self.cpu = None
+        self.wrapper = None
+        self.previous = None
+
+    def attach(self, cpu):
+        """Starts recording every instruction the CPU steps through"""
+        step = cpu.step
+        executed, taken, not_taken = self.executed, self.taken, self.not_taken
+
+        def covered_step(info):
+            pc = cpu.PC
+            executed[pc >> 3] |= 1 << (pc & 7)
+            step(info)
+            if info.opcode in BRANCHES:
+                # A branch to the next instruction counts as not taken
+                if cpu.PC == (pc + 2) & 0xFFFF:
+                    not_taken[pc >> 3] |= 1 << (pc & 7)
+                else:
+                    taken[pc >> 3] |= 1 << (pc & 7)
+
+        self.previous = cpu.wrap_step(covered_step)
+        self.wrapper = covered_step
+        self.cpu = cpu
+
+    def detach(self):
+        """Stops recording and restores the step that was replaced"""
+        self.cpu.unwrap_step(self.wrapper, self.previous)
+        self.cpu = self.wrapper = self.previous = None
+
+    def summary(self):
+        """Returns the number of executed addresses, taken branches and
+        branches that were not taken"""
+        return tuple(int.from_bytes(bitmap, 'little').bit_count()
+                     for bitmap in (self.executed, self.taken, self.not_taken))
+
+    def save(self, filename):
+        """Writes the bitmaps to a binary file"""
+        with open(filename, "wb") as f:
+            f.write(MAGIC + self.executed + self.taken + self.not_taken)
+
+    @classmethod
+    def load(cls, filename):
+        """Reads bitmaps written by CoverageMap.save"""
+        with open(filename, "rb") as f:
+            data = f.read()
+        if data[:len(MAGIC)] != MAGIC or len(data) != len(MAGIC) + 3 * MAP_SIZE:
+            raise Exception("File is not a coverage map.")
+
+        coverage = cls()
+        data = memoryview(data)[len(MAGIC):]
+        coverage.executed[:]  = data[:MAP_SIZE]
+        coverage.taken[:]     = data[MAP_SIZE:2 * MAP_SIZE]
+        coverage.not_taken[:] = data[2 * MAP_SIZE:]
+        return coverage
+
+    def listing(self, memory, start=0x8000, end=0xFFFF):
+        """Disassembles memory from start to end, marking executed
+        instructions with '*' and noting which ways branches went"""
+        lines = []
+        address = start
+        while address <= end:
+            opcode = memory[address]
+            size = max(instr_sizes[opcode], 1)
+            operand = memory[address + 1:min(address + size, 65536)]
+
+            # Bytes that were executed as instructions of their own can't
+            # be the operand of this one
+            if len(operand) < size - 1 or \
+                    any(check_address(self.executed, a)
+                        for a in range(address + 1, address + size)):
+                size, operand, text = 1, b'', ".byte $%02X" % opcode
+            elif opcode in BRANCHES:
+                offset = operand[0] - 256 if operand[0] & 128 else operand[0]
+                text = "%s $%04X" % (instr_names[opcode],
+                                     (address + 2 + offset) & 0xFFFF)
+            elif operand:
+                text = "%s $%0*X" % (instr_names[opcode], 2 * len(operand),
+                                     int.from_bytes(operand, 'little'))
+            else:
+                text = instr_names[opcode]
+
+            mark = "*" if check_address(self.executed, address) else " "
+            note = ""
+            if opcode in BRANCHES and mark == "*":
+                outcomes = (check_address(self.taken, address),
+                            check_address(self.not_taken, address))
+                # Nothing is known about branches that were written over
+                # code after it ran, or listed against different memory
+                note = {(True, True): "both ways", (True, False): "always taken",
+                        (False, True): "never taken"}.get(tuple(map(bool, outcomes)),
+                                                           "outcome unknown")
+
+            code = " ".join("%02X" % b for b in bytes([opcode]) + bytes(operand))
+            lines.append(("%s %04X  %-9s %-14s %s" %
+                          (mark, address, code, text, note)).rstrip())
+            address += size
+        return lines
+
+    def write_listing(self, filename, memory, start=0x8000, end=0xFFFF):
+        """Writes an annotated listing of memory to a text file"""
+        with open(filename, "w") as f:
+            executed, taken, not_taken = self.summary()
+            f.write("; %d instructions executed, %d branches taken, "
+                    "%d branches not taken\n" % (executed, taken, not_taken))
+            f.write("\n".join(self.listing(memory, start, end)) + "\n")
+
+
+if __name__ == '__main__':
+    from gamepak import GamePak
+    game = GamePak(sys.argv[1])
+    steps = int(sys.argv[2]) if len(sys.argv) >= 3 else 100000
+    output = sys.argv[3] if len(sys.argv) >= 4 else "coverage"
+
+    cpu = CPU()
+    for bank in range(0x8000, 0x10000, len(game.prg_rom)):
+        cpu.load(bank, game.prg_rom)
+    coverage = CoverageMap()
+    coverage.attach(cpu)
+    try:
+        cpu.run(steps)
+    except TypeError:
+        print("Stopped on incomplete instruction at PC = " + hex(cpu.PC))
+
+    coverage.save(output + ".cov")
+    coverage.write_listing(output + ".lst", cpu.memory)
+    print("%d instructions executed, %d branches taken, "
+          "%d branches not taken" % coverage.summary())
@@ -15,7 +15,7 @@ class Info():
 
 class CPU():
     """Emulates the NES 6502 CPU"""
-    def __init__(self):
+    def __init__(self, memory=None):
         self.PC = 0xC000     # Program counter
         self.A  = 0x00       # Accumulator
         self.X  = 0x00       # X index
@@ -24,11 +24,18 @@ class CPU():
         self.P  = 0b00100100 # Status register
 
         self.address_mode = ABSOLUTE # TODO, implement other modes
-        self.memory = [0] * 65536
+        # Any writable 64 KB buffer can back memory, e.g. a SharedState's
+        self.memory = memory if memory is not None else bytearray(65536)
         self.cycle = 0
         self.SL = 241   # TODO
         self.pc_set = False
 
+        self.pending = 0   # NMI and IRQ bits of interrupts waiting to be run
+        self.budget = 0    # Instructions left in the current batch
+        self.preempted = 0 # Instructions cut from the current batch
+        self.irq_delay = False # IRQs unmasked by the last instruction of a batch
+        self.superinstructions = None # See superinstructions.py
+
     def step(self, info):
         """Executes a single instruction"""
         self.pc_set = False
@@ -36,15 +43,121 @@ class CPU():
         instr_functions[info.opcode](self, info)
         self.cycle += instr_cycles[info.opcode]
         if not self.pc_set:
-            self.PC += info.size
+            self.PC = (self.PC + info.size) & 0xFFFF
+
+    def wrap_step(self, wrapper):
+        """Replaces step on this CPU with wrapper, returning the step it
+        replaced (None for the CPU's own) to pass to unwrap_step"""
+        previous = vars(self).get('step')
+        self.step = wrapper
+        return previous
+
+    def unwrap_step(self, wrapper, previous):
+        """Puts back the step replaced by wrapper. Wrappers have to be
+        removed in the reverse order to the one they were added in."""
+        if vars(self).get('step') is not wrapper:
+            raise RuntimeError("A step wrapper attached later has to be "
+                               "removed first")
+        if previous is None:
+            del self.step
+        else:
+            self.step = previous
+
+    def fetch(self):
+        """Decodes the instruction at the program counter"""
+        opcode = self.memory[self.PC]
+        size = instr_sizes[opcode]
+        operand = bytes(self.memory[self.PC + 1:self.PC + size])
+        return Info(opcode, size, operand, 'little')
+
+    def load(self, address, data):
+        """Copies data into memory starting at address"""
+        self.memory[address:address + len(data)] = data
+
+    def run(self, count, batch=BATCH_SIZE):
+        """Fetches and executes count instructions from memory, returning
+        the number executed. Pending interrupts are only serviced between
+        batches; raising one or unmasking IRQs cuts the current batch short,
+        so nothing is checked per instruction."""
+        step, fetch = self.step, self.fetch
+        # Wrappers around step need to see every instruction
+        fused = self.superinstructions if 'step' not in vars(self) else None
+        done = 0
+        while done < count:
+            if self.pending:
+                self.service_interrupts()
+            self.budget = min(batch, count - done)
+            self.preempted = 0
+            start = self.budget
+            if fused is not None:
+                fused.run_batch(self)
+            while self.budget > 0:
+                self.budget -= 1
+                step(fetch())
+            done += start - self.preempted
+        return done
+
+    def preempt(self, delay=0):
+        """Ends the current batch of CPU.run after delay more instructions
+        so that pending interrupts are looked at"""
+        if self.budget > delay:
+            self.preempted += self.budget - delay
+            self.budget = delay
+
+    def raise_nmi(self):
+        """Signals a non-maskable interrupt, which is run once"""
+        self.pending |= NMI
+        self.preempt()
+
+    def raise_irq(self):
+        """Asserts the IRQ line. IRQs are run while the line is held and
+        the interrupt disable flag is clear."""
+        self.pending |= IRQ
+        if not check_bit(self.P, 2):
+            self.preempt()
+
+    def clear_irq(self):
+        """Releases the IRQ line"""
+        self.pending &= ~IRQ
+        self.irq_delay = False
+
+    def delay_irq(self):
+        """Ends the current batch after the next instruction so that a
+        pending IRQ is run after it, waiting for that instruction into the
+        next batch if this one has no budget left"""
+        if self.budget == 0:
+            self.irq_delay = True
+        else:
+            self.preempt(1)
+
+    def service_interrupts(self):
+        """Runs the highest priority pending interrupt that is not
+        masked, if any"""
+        delayed, self.irq_delay = self.irq_delay, False
+        if self.pending & NMI:
+            self.pending &= ~NMI
+            self.interrupt(NMI_VECTOR, self.PC, self.P)
+        elif self.pending & IRQ and not check_bit(self.P, 2) and not delayed:
+            self.interrupt(IRQ_VECTOR, self.PC, self.P)
+        else:
+            return
+        self.cycle += 7
+
+    def interrupt(self, vector, ret, status):
+        """Pushes a return address and the status register on to the stack,
+        disables interrupts and jumps to the address held at vector"""
+        self.push(ret >> 8)
+        self.push(ret & 0xFF)
+        self.push(status | 0b00100000)
+        self.P = set_bit(self.P, 2)
+        self.set_pc(self.memory[vector] | (self.memory[vector + 1] << 8))
 
     def translate_address(self, address):
         """Translates a virtual address to 'physical' address in
         a .nes file"""
-        # 256 bytes per page
-        # start at page C, so C000 -> 0000
-        #            page offset (msb) + address (bottom 3 bytes)
-        return -3072 + (address >> 12)*256 + (address & 4095)
+        # 16 KB of PRG ROM is mirrored at $8000 and $C000, so
+        # C000 -> 0000 and FFFF -> 3FFF
+        return address & 0x3FFF
 
     def print_state(self, info):
         """Prints the current state of the CPU"""
@@ -83,6 +196,26 @@ class CPU():
         self.set_neg(value)
         self.set_zero(value)
 
+    def push(self, value):
+        """Pushes a byte on to the stack page and decrements the stack
+        pointer"""
+        self.memory[0x100 + self.SP] = value
+        self.SP = (self.SP - 1) & 0xFF
+
+    def pull(self):
+        """Increments the stack pointer and pulls a byte from the
+        stack page"""
+        self.SP = (self.SP + 1) & 0xFF
+        return self.memory[0x100 + self.SP]
+
+    def branch(self, info):
+        """Adds the signed relative displacement in an instruction to the
+        program counter"""
+        offset = info.value
+        if offset & 128:
+            offset -= 256
+        self.PC += offset
+
     def compare(self, reg, mem):
         """Compares the value of a register with a value in memory, updating
         the zero, negative, and carry flags as appropriate"""
@@ -92,6 +225,31 @@ class CPU():
         else:
             self.P = clear_bit(self.P, 0)
 
+    def brk(self, info):
+        """Forces an interrupt. The program counter and status register
+        (with the break flag set) are pushed on the stack and the IRQ
+        vector is loaded into the program counter."""
+        self.interrupt(IRQ_VECTOR, (self.PC + 2) & 0xFFFF, self.P | 0b00010000)
+
+    def rti(self, info):
+        """Returns from an interrupt, pulling the status register and then
+        the program counter from the stack"""
+        self.P = self.pull()
+        self.P = set_bit(self.P, 5) # This bit is always set
+        self.P = clear_bit(self.P, 4)
+        low = self.pull()
+        high = self.pull()
+        self.set_pc((high << 8) | low)
+        if self.pending & IRQ and not check_bit(self.P, 2):
+            self.preempt()
+
+    def cli(self, info):
+        """Clears the interrupt disable flag, allowing IRQs to be run
+        after the next instruction"""
+        self.P = clear_bit(self.P, 2)
+        if self.pending & IRQ:
+            self.delay_irq()
+
     def jmp(self, info):
         """Sets the program counter to the specified address"""
         self.set_pc(info.value)
@@ -109,9 +267,10 @@ class CPU():
     def jsr(self, info):
         """Pushes the address of the return point on to the stack and then
         sets the program counter to the target memory address"""
-        self.memory[self.SP] = self.PC + 3
+        ret = (self.PC + 2) & 0xFFFF # Address of the last byte of the JSR
+        self.push(ret >> 8)
+        self.push(ret & 0xFF)
         self.set_pc(info.value)
-        self.SP -= 2
 
     def nop(self, info):
         """Causes no changes to the processor other than the normal
@@ -126,7 +285,7 @@ class CPU():
         """If the carry flag is set then add the relative displacement to
         the program counter to cause a branch to a new location"""
         if self.P & 0b00000001:
-            self.PC += info.value
+            self.branch(info)
 
     def clc(self, info):
         """Sets the carry flag to zero"""
@@ -136,7 +295,7 @@ class CPU():
         """If the carry flag is clear then add the relative displacement
         to the program counter to cause a branch to a new location"""
         if not self.P & 0b00000001:
-            self.PC += info.value
+            self.branch(info)
 
     def lda(self, info):
         """Loads a byte of memory into the accumulator setting the zero
@@ -148,18 +307,40 @@ class CPU():
         """If the zero flag is set then add the relative displacement to
         the program counter to cause a branch to a new location"""
         if check_bit(self.P, 1):
-            self.PC += info.value
+            self.branch(info)
 
     def bne(self, info):
         """If the zero flag is clear then add the relative displacement to
         the program counter to cause a branch to a new location"""
         if not check_bit(self.P, 1):
-            self.PC += info.value
+            self.branch(info)
 
     def sta(self, info):
         """Stores the contents of the accumulator into memory"""
         self.memory[info.value] = self.A
 
+    def lda_x(self, info):
+        """Loads the byte at an absolute address plus the X register into
+        the accumulator setting the zero and negative flags as appropriate"""
+        self.A = self.memory[(info.value + self.X) & 0xFFFF]
+        self.set_zero_neg(self.A)
+
+    def lda_y(self, info):
+        """Loads the byte at an absolute address plus the Y register into
+        the accumulator setting the zero and negative flags as appropriate"""
+        self.A = self.memory[(info.value + self.Y) & 0xFFFF]
+        self.set_zero_neg(self.A)
+
+    def sta_x(self, info):
+        """Stores the accumulator at an absolute address plus the X
+        register"""
+        self.memory[(info.value + self.X) & 0xFFFF] = self.A
+
+    def sta_y(self, info):
+        """Stores the accumulator at an absolute address plus the Y
+        register"""
+        self.memory[(info.value + self.Y) & 0xFFFF] = self.A
+
     def bit(self, info):
         """This instruction is used to test if one or more bits are set in a
         target memory location. The mask pattern in A is ANDed with the value
@@ -175,26 +356,27 @@ class CPU():
         """If the overflow flag is set then add the relative displacement to
         the program counter to cause a branch to a new location"""
         if check_bit(self.P, 6):
-            self.PC += info.value
+            self.branch(info)
 
     def bvc(self, info):
         """If the overflow flag is clear then add the relative displacement to
         the program counter to cause a branch to a new location"""
         if not check_bit(self.P, 6):
-            self.PC += info.value
+            self.branch(info)
 
     def bpl(self, info):
         """If the negative flag is clear then add the relative displacement to
         the program counter to cause a branch to a new location"""
         if not check_bit(self.P, 7):
-            self.PC += info.value
+            self.branch(info)
 
     def rts(self, info):
         """The RTS instruction is used at the end of a subroutine to return to
         the calling routine. It pulls the program counter (minus one) from
         the stack"""
-        self.SP += 2
-        self.set_pc(self.memory[self.SP])
+        low = self.pull()
+        high = self.pull()
+        self.set_pc((((high << 8) | low) + 1) & 0xFFFF)
 
     def sei(self, info):
         """Set the interrupt disable flag to one"""
@@ -206,14 +388,12 @@ class CPU():
 
     def php(self, info):
         """Pushes a copy of the status reg on to the stack with bit 4 true"""
-        self.SP -= 1
-        self.memory[self.SP] = set_bit(self.P, 4)
+        self.push(self.P | 0b00110000)
 
     def pla(self, info):
         """Pulls an 8 bit value from the stack and into the accumulator.
         The zero and negative flags are set as appropriate"""
-        self.A = self.memory[self.SP]
-        self.SP += 1
+        self.A = self.pull()
         self.set_zero_neg(self.A)
 
     def and_(self, info):
@@ -234,22 +414,22 @@ class CPU():
 
     def pha(self, info):
         """Pushes a copy of the accumulator on to the stack"""
-        self.SP -= 1
-        self.memory[self.SP] = self.A
+        self.push(self.A)
 
     def plp(self, info):
         """Pulls an 8 bit value from the stack and into the processor flags.
         The flags will take on new states as determined by the value pulled"""
-        self.P = self.memory[self.SP]
+        self.P = self.pull()
         self.P = set_bit(self.P, 5) # This bit is always set
         self.P = clear_bit(self.P, 4)
-        self.SP += 1
+        if self.pending & IRQ and not check_bit(self.P, 2):
+            self.delay_irq()
 
     def bmi(self, info):
         """If the negative flag is set then add the relative displacement to
         the program counter to cause a branch to a new location"""
         if check_bit(self.P, 7):
-            self.P += info.value
+            self.branch(info)
 
     def ora(self, info):
         """Performs an CPU.inclusive OR on the accumulator using the contents of
@@ -307,17 +487,76 @@ class CPU():
     def inc(self, info):
         """Adds one to the value held at a specified memory location and sets
         the zero and negative flags as appropriate"""
-        val = self.memory[info.value] + 1
+        val = (self.memory[info.value] + 1) & 0xFF
         self.memory[info.value] = val
         self.set_zero_neg(val)
 
     def dec(self, info):
         """Subtracts one to the value held at a specified memory location and
         sets the zero and negative flags as appropriate"""
-        val = self.memory[info.value] - 1
+        val = (self.memory[info.value] - 1) & 0xFF
         self.memory[info.value] = val
         self.set_zero_neg(val)
 
+    def inx(self, info):
+        """Adds one to the X register setting the zero and negative flags as
+        appropriate"""
+        self.X = (self.X + 1) & 0xFF
+        self.set_zero_neg(self.X)
+
+    def iny(self, info):
+        """Adds one to the Y register setting the zero and negative flags as
+        appropriate"""
+        self.Y = (self.Y + 1) & 0xFF
+        self.set_zero_neg(self.Y)
+
+    def dex(self, info):
+        """Subtracts one from the X register setting the zero and negative
+        flags as appropriate"""
+        self.X = (self.X - 1) & 0xFF
+        self.set_zero_neg(self.X)
+
+    def dey(self, info):
+        """Subtracts one from the Y register setting the zero and negative
+        flags as appropriate"""
+        self.Y = (self.Y - 1) & 0xFF
+        self.set_zero_neg(self.Y)
+
+    def tax(self, info):
+        """Copies the accumulator into the X register setting the zero and
+        negative flags as appropriate"""
+        self.X = self.A
+        self.set_zero_neg(self.X)
+
+    def tay(self, info):
+        """Copies the accumulator into the Y register setting the zero and
+        negative flags as appropriate"""
+        self.Y = self.A
+        self.set_zero_neg(self.Y)
+
+    def txa(self, info):
+        """Copies the X register into the accumulator setting the zero and
+        negative flags as appropriate"""
+        self.A = self.X
+        self.set_zero_neg(self.A)
+
+    def tya(self, info):
+        """Copies the Y register into the accumulator setting the zero and
+        negative flags as appropriate"""
+        self.A = self.Y
+        self.set_zero_neg(self.A)
+
+    def tsx(self, info):
+        """Copies the stack pointer into the X register setting the zero and
+        negative flags as appropriate"""
+        self.X = self.SP
+        self.set_zero_neg(self.X)
+
+    def txs(self, info):
+        """Copies the X register into the stack pointer. No flags are
+        affected."""
+        self.SP = self.X
+
     def asl(self, info):
         """This operation shifts all the bits of the accumulator. Bit 0 is set
         to 0 and bit 7 is placed in the carry flag. The effect of this operation
@@ -326,13 +565,12 @@ class CPU():
         8 bits."""
         # TODO should be able to shift a mem loc as well
         # but that requires modes
-        self.P = clear_bit(self.P, 0)
-        if check_bit(self.A, 0):
-            self.P = set_bit(self.P, 7)
+        if check_bit(self.A, 7):
+            self.P = set_bit(self.P, 0)
         else:
-            self.P = clear_bit(self.P, 7)
+            self.P = clear_bit(self.P, 0)
 
-        self.A = self.A << 1
+        self.A = (self.A << 1) & 0xFF
         self.set_zero_neg(self.A)
 
     def lsr(self, info):
@@ -340,11 +578,10 @@ class CPU():
         The bit that was in bit 0 is shifted into the carry flag. Bit 7 is
         set to zero."""
         # TODO should be able to shift a mem loc as well
-        self.P = clear_bit(self.P, 0)
         if check_bit(self.A, 0):
-            self.P = set_bit(self.P, 7)
+            self.P = set_bit(self.P, 0)
         else:
-            self.P = clear_bit(self.P, 7)
+            self.P = clear_bit(self.P, 0)
 
         self.A = self.A >> 1
         self.set_zero_neg(self.A)
@@ -431,7 +668,7 @@ class CPU():
         pass
 
 instr_functions = [
-    "BRK", CPU.ora, CPU.kil, CPU.slo, CPU.nop, CPU.ora, CPU.asl, CPU.slo,
+    CPU.brk, CPU.ora, CPU.kil, CPU.slo, CPU.nop, CPU.ora, CPU.asl, CPU.slo,
     CPU.php, CPU.ora, CPU.asl, CPU.anc, CPU.nop, CPU.ora, CPU.asl, CPU.slo,
     CPU.bpl, CPU.ora, CPU.kil, CPU.slo, CPU.nop, CPU.ora, CPU.asl, CPU.slo,
     CPU.clc, CPU.ora, CPU.nop, CPU.slo, CPU.nop, CPU.ora, CPU.asl, CPU.slo,
@@ -439,28 +676,28 @@ instr_functions = [
     CPU.plp, CPU.and_, "ROL", CPU.anc, CPU.bit, CPU.and_, "ROL", CPU.rla,
     CPU.bmi, CPU.and_, CPU.kil, CPU.rla, CPU.nop, CPU.and_, "ROL", CPU.rla,
     CPU.sec, CPU.and_, CPU.nop, CPU.rla, CPU.nop, CPU.and_, "ROL", CPU.rla,
-    "RTI", CPU.eor, CPU.kil, CPU.sre, CPU.nop, CPU.eor, CPU.lsr, CPU.sre,
+    CPU.rti, CPU.eor, CPU.kil, CPU.sre, CPU.nop, CPU.eor, CPU.lsr, CPU.sre,
     CPU.pha, CPU.eor, CPU.lsr, CPU.alr, CPU.jmp, CPU.eor, CPU.lsr, CPU.sre,
     CPU.bvc, CPU.eor, CPU.kil, CPU.sre, CPU.nop, CPU.eor, CPU.lsr, CPU.sre,
-    "CLI", CPU.eor, CPU.nop, CPU.sre, CPU.nop, CPU.eor, CPU.lsr, CPU.sre,
+    CPU.cli, CPU.eor, CPU.nop, CPU.sre, CPU.nop, CPU.eor, CPU.lsr, CPU.sre,
     CPU.rts, CPU.adc, CPU.kil, CPU.rra, CPU.nop, CPU.adc, "ROR", CPU.rra,
     CPU.pla, CPU.adc, "ROR", CPU.arr, CPU.jmp, CPU.adc, "ROR", CPU.rra,
     CPU.bvs, CPU.adc, CPU.kil, CPU.rra, CPU.nop, CPU.adc, "ROR", CPU.rra,
     CPU.sei, CPU.adc, CPU.nop, CPU.rra, CPU.nop, CPU.adc, "ROR", CPU.rra,
     CPU.nop, CPU.sta, CPU.nop, CPU.sax, "STY", CPU.sta, CPU.stx, CPU.sax,
-    "DEY", CPU.nop, "TXA", CPU.xaa, "STY", CPU.sta, CPU.stx, CPU.sax,
+    CPU.dey, CPU.nop, CPU.txa, CPU.xaa, "STY", CPU.sta, CPU.stx, CPU.sax,
     CPU.bcc, CPU.sta, CPU.kil, CPU.ahx, "STY", CPU.sta, CPU.stx, CPU.sax,
-    "TYA", CPU.sta, "TXS", "TAS", "SHY", CPU.sta, CPU.shx, CPU.ahx,
+    CPU.tya, CPU.sta_y, CPU.txs, "TAS", "SHY", CPU.sta_x, CPU.shx, CPU.ahx,
     CPU.ldy, CPU.lda, CPU.ldx, CPU.lax, CPU.ldy, CPU.lda, CPU.ldx, CPU.lax,
-    "TAY", CPU.lda, "TAX", CPU.lax, CPU.ldy, CPU.lda, CPU.ldx, CPU.lax,
+    CPU.tay, CPU.lda, CPU.tax, CPU.lax, CPU.ldy, CPU.lda, CPU.ldx, CPU.lax,
     CPU.bcs, CPU.lda, CPU.kil, CPU.lax, CPU.ldy, CPU.lda, CPU.ldx, CPU.lax,
-    CPU.clv, CPU.lda, "TSX", "LAS", CPU.ldy, CPU.lda, CPU.ldx, CPU.lax,
+    CPU.clv, CPU.lda_y, CPU.tsx, "LAS", CPU.ldy, CPU.lda_x, CPU.ldx, CPU.lax,
     CPU.cpy, CPU.cmp, CPU.nop, CPU.dcp, CPU.cpy, CPU.cmp, CPU.dec, CPU.dcp,
-    "INY", CPU.cmp, "DEX", CPU.axs, CPU.cpy, CPU.cmp, CPU.dec, CPU.dcp,
+    CPU.iny, CPU.cmp, CPU.dex, CPU.axs, CPU.cpy, CPU.cmp, CPU.dec, CPU.dcp,
     CPU.bne, CPU.cmp, CPU.kil, CPU.dcp, CPU.nop, CPU.cmp, CPU.dec, CPU.dcp,
     CPU.cld, CPU.cmp, CPU.nop, CPU.dcp, CPU.nop, CPU.cmp, CPU.dec, CPU.dcp,
     CPU.cpx, "SBC", CPU.nop, CPU.isc, CPU.cpx, "SBC", CPU.inc, CPU.isc,
-    "INX", "SBC", CPU.nop, "SBC", CPU.cpx, "SBC", CPU.inc, CPU.isc,
+    CPU.inx, "SBC", CPU.nop, "SBC", CPU.cpx, "SBC", CPU.inc, CPU.isc,
     CPU.beq, "SBC", CPU.kil, CPU.isc, CPU.nop, "SBC", CPU.inc, CPU.isc,
     CPU.sed, "SBC", CPU.nop, CPU.isc, CPU.nop, "SBC", CPU.inc, CPU.isc
 ]
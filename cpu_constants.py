@@ -13,6 +13,25 @@ ZP_INDEXED  = 7
 INDIRECT    = 8
 PI_INDIRECT = 9
 
+# Memory mapped PPU, APU and controller registers
+IO_START = 0x2000
+IO_END   = 0x4020
+
+# Writes from here up go to the cartridge mapper rather than to memory
+ROM_START = 0x8000
+
+# Interrupt vectors
+NMI_VECTOR   = 0xFFFA
+RESET_VECTOR = 0xFFFC
+IRQ_VECTOR   = 0xFFFE
+
+# Bits of CPU.pending
+NMI = 1
+IRQ = 2
+
+# Instructions run by CPU.run between checks for pending interrupts
+BATCH_SIZE = 1024
+
 instr_names = [
     "BRK", "ORA", "KIL", "SLO", "NOP", "ORA", "ASL", "SLO",
     "PHP", "ORA", "ASL", "ANC", "NOP", "ORA", "ASL", "SLO",
@@ -0,0 +1,206 @@
+"""Differential fuzzer for the CPU.
+
+Generates random instruction sequences and initial states, runs each one on
+the CPU and on the reference model in reference.py, and shrinks any case
+where the two disagree down to a minimal reproducer. Cases are spread over a
+process pool so every core is kept busy.
+
+Usage: python3 fuzz.py [-n CASES] [-j JOBS] [-s SEED] [-l LENGTH]"""
+import sys, time, random, argparse
+from multiprocessing import Pool, cpu_count
+from cpu import *
+import reference
+
+# Only RAM is touched by generated programs, so only RAM is compared
+RAM_SIZE = 0x800
+
+# Number of cases handed to a worker at a time
+CHUNK_SIZE = 2000
+
+OPCODES = sorted(reference.OPS)
+
+# Absolute,X and absolute,Y instructions, which can reach 255 bytes further
+INDEXED = frozenset((0xBD, 0xB9, 0x9D, 0x99))
+
+# Program counters that exercise wrap-around at the top of memory
+EDGE_PCS = (0x0000, 0xFFFD, 0xFFFE, 0xFFFF)
+
+
+class Case():
+    """An initial CPU state and the instructions to run from it"""
+    def __init__(self, registers, ram, program):
+        self.registers = registers # (A, X, Y, P, SP, PC)
+        self.ram = ram             # RAM_SIZE bytes
+        self.program = program     # [(opcode, operand bytes), ...]
+
+    def __str__(self):
+        a, x, y, p, sp, pc = self.registers
+        nonzero = ["%03x:%02x" % (i, b) for i, b in enumerate(self.ram) if b]
+        lines = ["A:%02x X:%02x Y:%02x P:%02x SP:%02x PC:%04x" %
+                 (a, x, y, p, sp, pc),
+                 "RAM: " + (" ".join(nonzero) if nonzero else "all zero")]
+        for opcode, operand in self.program:
+            lines.append("  %02x %-6s %s" % (opcode, operand[::-1].hex(),
+                                              instr_names[opcode]))
+        return "\n".join(lines)
+
+
+def random_case(rng, length):
+    """Generates a random Case with up to length instructions"""
+    pc = rng.getrandbits(16) if rng.getrandbits(3) else rng.choice(EDGE_PCS)
+    registers = (rng.getrandbits(8), rng.getrandbits(8), rng.getrandbits(8),
+                 (rng.getrandbits(8) | 0x20) & ~0x10, rng.getrandbits(8), pc)
+    program = []
+    for _ in range(rng.randint(1, length)):
+        opcode = rng.choice(OPCODES)
+        size = reference.OPS[opcode][1]
+        if opcode in (0x4C, 0x20):
+            # Jump targets can be anywhere
+            operand = rng.getrandbits(16).to_bytes(2, 'little')
+        elif opcode in INDEXED:
+            operand = rng.randrange(RAM_SIZE - 0xFF).to_bytes(2, 'little')
+        elif size == 3:
+            # Memory operands stay inside RAM
+            operand = rng.randrange(RAM_SIZE).to_bytes(2, 'little')
+        else:
+            operand = rng.getrandbits(8 * (size - 1)).to_bytes(size - 1, 'little')
+        program.append((opcode, operand))
+    return Case(registers, rng.randbytes(RAM_SIZE), program)
+
+
+def check(cpu, case):
+    """Runs a case on both the CPU and the reference model. Returns None if
+    they agree, otherwise a description of the first difference."""
+    a, x, y, p, sp, pc = case.registers
+    cpu.A, cpu.X, cpu.Y, cpu.P, cpu.SP, cpu.PC = a, x, y, p, sp, pc
+    cpu.cycle = 0
+    cpu.memory[0:RAM_SIZE] = case.ram
+    ref = reference.RefState(a, x, y, p, sp, pc, case.ram)
+
+    for i, (opcode, operand) in enumerate(case.program):
+        reference.execute(ref, opcode, operand)
+        try:
+            cpu.step(Info(opcode, len(operand) + 1, operand, 'little'))
+        except Exception as e:
+            return "instruction %d (%s): raised %r" % \
+                (i, instr_names[opcode], e)
+
+        got = (cpu.A, cpu.X, cpu.Y, cpu.P, cpu.SP, cpu.PC, cpu.cycle)
+        expected = ref.registers()
+        if got != expected:
+            names = ("A", "X", "Y", "P", "SP", "PC", "CYC")
+            diffs = ["%s=%x (expected %x)" % (n, g, e)
+                     for n, g, e in zip(names, got, expected) if g != e]
+            return "instruction %d (%s): %s" % \
+                (i, instr_names[opcode], ", ".join(diffs))
+
+    try:
+        ram = bytes(cpu.memory[0:RAM_SIZE])
+    except (ValueError, TypeError) as e:
+        return "memory holds a value that is not a byte: %r" % e
+    if ram != ref.memory[0:RAM_SIZE]:
+        addr = next(i for i in range(RAM_SIZE) if ram[i] != ref.memory[i])
+        return "memory[%03x]=%x (expected %x)" % \
+            (addr, ram[addr], ref.memory[addr])
+    return None
+
+
+def shrink(cpu, case):
+    """Reduces a failing case to a smaller one that still fails"""
+    def fails(c):
+        return check(cpu, c) is not None
+
+    # Remove chunks of instructions, halving the chunk size each pass
+    program = case.program
+    chunk = max(len(program) // 2, 1)
+    while chunk >= 1:
+        i = 0
+        while i < len(program):
+            smaller = program[:i] + program[i + chunk:]
+            if smaller and fails(Case(case.registers, case.ram, smaller)):
+                program = smaller
+            else:
+                i += chunk
+        chunk //= 2
+    case = Case(case.registers, case.ram, program)
+
+    # Zero out RAM in ever smaller blocks, then operands and registers
+    ram = bytearray(case.ram)
+    chunk = RAM_SIZE
+    while chunk >= 1:
+        for start in range(0, RAM_SIZE, chunk):
+            if not any(ram[start:start + chunk]):
+                continue
+            saved = ram[start:start + chunk]
+            ram[start:start + chunk] = bytes(chunk)
+            if not fails(Case(case.registers, bytes(ram), case.program)):
+                ram[start:start + chunk] = saved
+        chunk //= 2
+    case = Case(case.registers, bytes(ram), case.program)
+    for i, (opcode, operand) in enumerate(case.program):
+        program = list(case.program)
+        program[i] = (opcode, bytes(len(operand)))
+        simpler = Case(case.registers, case.ram, program)
+        if fails(simpler):
+            case = simpler
+    defaults = (0x00, 0x00, 0x00, 0x24, 0xFD, 0xC000)
+    for i, default in enumerate(defaults):
+        registers = list(case.registers)
+        registers[i] = default
+        simpler = Case(tuple(registers), case.ram, case.program)
+        if fails(simpler):
+            case = simpler
+    return case
+
+
+def run_chunk(args):
+    """Worker entry point. Runs count cases from the given seed and returns
+    the number run along with any failures."""
+    seed, count, length = args
+    rng = random.Random(seed)
+    cpu = CPU()
+    failures = []
+    for _ in range(count):
+        case = random_case(rng, length)
+        message = check(cpu, case)
+        if message is not None:
+            failures.append((case, message))
+    return count, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--cases', type=int, default=100000)
+    parser.add_argument('-j', '--jobs', type=int, default=cpu_count())
+    parser.add_argument('-s', '--seed', type=int, default=None)
+    parser.add_argument('-l', '--length', type=int, default=16,
+                        help="maximum instructions per case")
+    parser.add_argument('--show', type=int, default=3,
+                        help="number of failures to shrink and print")
+    args = parser.parse_args(argv)
+
+    seed = args.seed if args.seed is not None else random.getrandbits(32)
+    chunks = [(seed + i, min(CHUNK_SIZE, args.cases - start), args.length)
+              for i, start in enumerate(range(0, args.cases, CHUNK_SIZE))]
+
+    start = time.perf_counter()
+    done, failures = 0, []
+    with Pool(args.jobs) as pool:
+        for count, found in pool.imap_unordered(run_chunk, chunks):
+            done += count
+            failures.extend(found)
+    elapsed = time.perf_counter() - start
+
+    print("Seed %d: %d cases, %d failures in %.2fs (%d cases/s)" %
+          (seed, done, len(failures), elapsed, done / elapsed))
+
+    cpu = CPU()
+    for case, message in failures[:args.show]:
+        case = shrink(cpu, case)
+        print("\n" + check(cpu, case))
+        print(case)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""Recognises memory fill and block copy loops and runs them in bulk.
+
+Startup code clears RAM and copies tables into place with tight loops like
+
+    loop: STA $0200,X          loop: LDA $C300,Y
+          STA $0300,X                STA $0300,Y
+          INX                        DEY
+          BNE loop                   CPY #$80
+                                     BNE loop
+
+that run hundreds of iterations one instruction at a time. A Loop runs every
+iteration in one go as slice assignments on the memory buffer, leaving the
+index register, A, the flags, the program counter and the cycle count
+exactly as iterating would have. Loops are found when Superinstructions
+decodes the code at their first instruction.
+
+Loops that would store to an I/O register or the cartridge, load from an
+I/O register, store over their own code or copy between overlapping ranges
+are run one instruction at a time instead."""
+from cpu import *
+from cpu_constants import *
+
+# Absolute indexed loads and stores and the index register they use
+LOADS  = {0xBD: 'X', 0xB9: 'Y'}
+STORES = {0x9D: 'X', 0x99: 'Y'}
+
+# Index register and direction of INX, DEX, INY and DEY
+STEPS = {0xE8: ('X', 1), 0xCA: ('X', -1), 0xC8: ('Y', 1), 0x88: ('Y', -1)}
+
+COMPARES = {0xE0: 'X', 0xC0: 'Y'}
+BNE = 0xD0
+
+# Most loads and stores in a loop body
+MAX_OPS = 8
+MAX_LENGTH = 3 * MAX_OPS + 5
+
+
+def overlaps(start, stop, other_start, other_stop):
+    """Checks if two address ranges share an address"""
+    return start < other_stop and other_start < stop
+
+
+def recognize(memory, pc, single):
+    """Returns a Loop if the code at pc is a fill or copy loop, otherwise
+    None. single runs just the first instruction of the loop."""
+    code = bytes(memory[pc:pc + MAX_LENGTH])
+    ops = []
+    i = 0
+    try:
+        while code[i] in LOADS or code[i] in STORES:
+            if len(ops) == MAX_OPS:
+                return None
+            ops.append((code[i], code[i + 1] | (code[i + 2] << 8)))
+            i += 3
+        index, step = STEPS[code[i]]
+        i += 1
+        compare = None
+        if code[i] in COMPARES:
+            if COMPARES[code[i]] != index:
+                return None
+            compare = code[i + 1]
+            i += 2
+        if code[i] != BNE or pc + i + 2 + code[i + 1] - 256 != pc:
+            return None
+        i += 2
+    except (IndexError, KeyError):
+        return None
+
+    registers = [LOADS.get(opcode) or STORES.get(opcode) for opcode, _ in ops]
+    if not any(opcode in STORES for opcode, _ in ops) or \
+            any(register != index for register in registers) or \
+            (any(opcode in LOADS for opcode, _ in ops) and ops[0][0] not in LOADS):
+        return None
+    return Loop(pc, code[:i], ops, index, step, compare, single)
+
+
+class Loop():
+    """A fill or copy loop that can be run all at once"""
+    def __init__(self, pc, code, ops, index, step, compare, single):
+        self.pc = pc
+        self.code = code
+        self.length = len(code)
+        self.end = (pc + self.length) & 0xFFFF
+        self.ops = ops           # [(opcode, base address), ...]
+        self.index = index       # 'X' or 'Y'
+        self.step = step         # 1 or -1
+        self.compare = compare   # CPX/CPY immediate, or None
+        self.single = single     # Runs the first instruction on its own
+        self.loads = [base for opcode, base in ops if opcode in LOADS]
+
+        tail = [opcode for opcode in STEPS if STEPS[opcode] == (index, step)]
+        if compare is not None:
+            tail.append(next(o for o in COMPARES if COMPARES[o] == index))
+        tail.append(BNE)
+        self.instructions = len(ops) + len(tail)
+        self.cycles = sum(instr_cycles[opcode] for opcode, _ in ops) + \
+            sum(instr_cycles[opcode] for opcode in tail)
+
+        # Superinstructions runs a loop as one instruction, and the loop
+        # takes the rest of its instructions from the CPU's budget
+        self.count = 1
+        self.first = self
+
+    def iterations(self, start):
+        """Returns how many times the loop body runs from an index value"""
+        stop = self.compare if self.compare is not None else 0
+        return ((stop - start) * self.step) & 0xFF or 256
+
+    def ranges(self, start, count):
+        """Returns the index values of count iterations as ascending
+        [low, high) ranges"""
+        if self.step > 0:
+            low, high = start, start + count
+        else:
+            low, high = start - count + 1, start + 1
+        if low < 0:
+            return [(0, high), (low + 256, 256)]
+        if high > 256:
+            return [(low, 256), (0, high - 256)]
+        return [(low, high)]
+
+    def safe(self, ranges):
+        """Checks if the iterations over ranges can be run in bulk"""
+        loads, stores = [], []
+        for low, high in ranges:
+            for opcode, base in self.ops:
+                start, stop = base + low, base + high
+                if stop > 0x10000 or overlaps(start, stop, IO_START, IO_END):
+                    return False
+                if opcode in STORES:
+                    if stop > ROM_START or \
+                            overlaps(start, stop, self.pc, self.pc + self.length):
+                        return False
+                    stores.append((start, stop))
+                else:
+                    loads.append((start, stop))
+
+        if loads:
+            # Copies must not depend on the order bytes are copied in
+            ranges = loads + stores
+            for i, (start, stop) in enumerate(stores):
+                if any(overlaps(start, stop, other_start, other_stop)
+                       for other_start, other_stop in ranges[:len(loads) + i]):
+                    return False
+        return True
+
+    def handler(self, cpu):
+        """Runs as many iterations as the CPU's budget allows, or the first
+        instruction on its own if the loop can't be run in bulk"""
+        start = getattr(cpu, self.index)
+        total = self.iterations(start)
+        count = min(total, (cpu.budget + 1) // self.instructions)
+        ranges = self.ranges(start, count) if count else None
+        if not count or not self.safe(ranges):
+            self.single.handler(cpu)
+            return
+
+        memory = cpu.memory
+        for low, high in ranges:
+            source = None
+            for opcode, base in self.ops:
+                if opcode in LOADS:
+                    source = base
+                elif source is None:
+                    memory[base + low:base + high] = bytes((cpu.A,)) * (high - low)
+                else:
+                    memory[base + low:base + high] = \
+                        bytes(memory[source + low:source + high])
+
+        last = (start + self.step * (count - 1)) & 0xFF
+        if self.loads:
+            cpu.A = memory[self.loads[-1] + last]
+        value = (last + self.step) & 0xFF
+        setattr(cpu, self.index, value)
+        if self.compare is not None:
+            cpu.compare(value, self.compare)
+        else:
+            cpu.set_zero_neg(value)
+
+        cpu.PC = self.end if count == total else self.pc
+        cpu.cycle += count * self.cycles
+        cpu.budget -= count * self.instructions - 1
@@ -1,6 +1,7 @@
 import sys
 from cpu import *
 from cli import *
+from shared import SharedState
 
 # TODO
 # Write a parser for labels to run when program_name != None
@@ -11,41 +12,62 @@ from cli import *
 #
 # Print 'status' in a nicer way
 # Finish the README and help features
-def main(program_name=None):
-    cpu = CPU()
+def main(program_name=None, shared_name=None):
+    shared = None
+    if shared_name is not None:
+        # Memory and registers are visible to other processes
+        shared = SharedState(shared_name)
+        print("Sharing CPU state as '%s'" % shared.name)
+    cpu = CPU(shared.memory if shared else None)
     cli = CLI(cpu)
 
-    if program_name:
-        cli.execute(program_name)
-        sys.exit()
-    else:
-        print("Virtual6502 v1.1 \n"
-        "Type help or view the readme for instructions. \n")
-
-        while True:
-            inp = input('> ').lower().split(' ')
-            if len(inp) == 0:
-                continue
-
-            try:
-                cmd = inp[0]
-                if cmd in cli.cli_funcs:
-                    # Input does not affect CPU
-                    cli.cli_funcs[cmd](inp)
-                else:
-                    # Input was a CPU instruction
-                    cpu.step(cli.step(inp))
-                    cli.print_state(inp)
-            except SystemExit:
-                raise
-            except:
-                pass
-
-            cli.buffer_push(cmd)
+    try:
+        if program_name:
+            cli.execute(program_name)
+            sys.exit()
+        repl(cpu, cli, shared)
+    finally:
+        # Also runs on Ctrl-C and Ctrl-D so the shared block is removed
+        if shared:
+            shared.close()
 
 
+def repl(cpu, cli, shared=None):
+    """Reads and runs commands and instructions until the user quits"""
+    print("Virtual6502 v1.1 \n"
+    "Type help or view the readme for instructions. \n")
+
+    while True:
+        inp = input('> ').split()
+        if len(inp) == 0:
+            continue
+
+        # Commands like fill and load write memory too, so readers must
+        # not take a snapshot until the state is published again
+        if shared:
+            shared.begin()
+        try:
+            cmd = inp[0].lower()
+            if cmd in cli.cli_funcs:
+                # Input does not affect CPU
+                cli.cli_funcs[cmd](inp)
+            else:
+                # Input was a CPU instruction
+                cpu.step(cli.step(inp))
+                cli.print_state(inp)
+        except SystemExit:
+            raise
+        except:
+            pass
+
+        if shared:
+            shared.publish(cpu)
+        cli.buffer_push(cmd)
+
 if __name__ == '__main__':
-    if len(sys.argv) >= 2:
-        main(sys.argv[1])
-    else:
-        main()
+    args = sys.argv[1:]
+    shared_name = None
+    if len(args) >= 2 and args[0] == '--shared':
+        shared_name = args[1]
+        args = args[2:]
+    main(args[0] if args else None, shared_name)
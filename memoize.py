@@ -0,0 +1,254 @@
+"""Memoizes subroutines that are pure functions of registers and memory.
+
+Many ROM routines (maths, table lookups, decompressors) are called over and
+over with the same inputs. Once attached to a CPU, a SubroutineMemoizer
+profiles each JSR up to its matching RTS, recording the memory the routine
+read before writing (its inputs) and the final value of everything it wrote
+(its outputs). Routines that touch I/O registers, modify their own code or
+play tricks with the stack are never cached, and calls that are interrupted
+are not recorded. For the rest, the registers and
+outputs after the RTS and the cycles taken are kept in an LRU cache keyed
+by the registers and input bytes at the JSR, and a later call with the same
+inputs applies them directly instead of running the routine. A routine's
+cache is dropped when any of its code bytes change.
+
+A memoized call counts as a single instruction in CPU.run."""
+from collections import OrderedDict
+from operator import itemgetter
+from cpu_constants import *
+
+JSR = 0x20
+RTS = 0x60
+RTI = 0x40
+BRK = 0x00
+
+# Routines running longer than this are not worth recording
+MAX_STEPS = 10000
+
+
+def gather(addresses):
+    """Returns a function that reads the given addresses from memory into a
+    tuple in one call"""
+    if not addresses:
+        return lambda memory: ()
+    if len(addresses) == 1:
+        address = addresses[0]
+        return lambda memory: (memory[address],)
+    return itemgetter(*addresses)
+
+
+class RecordingMemory():
+    """Stands in for CPU memory while a subroutine is profiled, noting the
+    addresses read before being written and the last value written to each
+    address"""
+    def __init__(self, memory):
+        self.memory = memory
+        self.reads  = {}
+        self.writes = {}
+        self.io = False
+
+    def __len__(self):
+        return len(self.memory)
+
+    def __getitem__(self, address):
+        if isinstance(address, slice):
+            for a in range(*address.indices(len(self.memory))):
+                self[a]
+            return self.memory[address]
+
+        value = self.memory[address]
+        if address not in self.writes:
+            self.reads.setdefault(address, value)
+        if IO_START <= address < IO_END:
+            self.io = True
+        return value
+
+    def __setitem__(self, address, value):
+        self.memory[address] = value
+        self.writes[address] = value
+        if IO_START <= address < IO_END or address >= ROM_START:
+            self.io = True
+
+
+class Recording():
+    """A subroutine call that is being profiled"""
+    def __init__(self, cpu, target, routine):
+        self.target = target
+        self.routine = routine
+        self.memory = RecordingMemory(cpu.memory)
+        self.registers = (cpu.A, cpu.X, cpu.Y, cpu.P, cpu.SP)
+        self.cycle = cpu.cycle
+        self.sp = cpu.SP
+        self.pc = cpu.PC         # Where the next instruction should be
+        self.code = set()
+        self.depth = 0
+        self.steps = 0
+
+
+class Routine():
+    """What is known about the subroutine at one address"""
+    def __init__(self, max_entries):
+        self.reads = ()          # Sorted union of input addresses
+        self.read = gather(())
+        self.code = ()           # Sorted union of executed code addresses
+        self.code_bytes = ()
+        self.fetch_code = gather(())
+        self.cache = OrderedDict()
+        self.max_entries = max_entries
+
+    def key(self, cpu):
+        """Returns the cache key for a call with the CPU's current state"""
+        return (cpu.A, cpu.X, cpu.Y, cpu.P, cpu.SP) + self.read(cpu.memory)
+
+    def store(self, key, outputs):
+        """Adds an entry to the cache, dropping the least recently used
+        entry if it is full"""
+        self.cache[key] = outputs
+        if len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+
+
+class SubroutineMemoizer():
+    """Caches the results of pure subroutines called with JSR"""
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.routines = {}
+        self.impure = set()
+        self.recording = None
+        self.cpu = None
+        self.wrapper = None
+        self.previous = None
+        self.hits = 0
+        self.misses = 0
+
+    def attach(self, cpu):
+        """Starts memoizing subroutines called by the CPU"""
+        step = cpu.step
+
+        def memoized_step(info):
+            if self.recording is not None:
+                self.record(step, info)
+            elif info.opcode == JSR and info.value not in self.impure:
+                step(info)
+                self.call(info.value)
+            else:
+                step(info)
+
+        self.previous = cpu.wrap_step(memoized_step)
+        self.wrapper = memoized_step
+        self.cpu = cpu
+
+    def detach(self):
+        """Stops memoizing and restores the step that was replaced"""
+        self.cpu.unwrap_step(self.wrapper, self.previous)
+        self.recording = None
+        self.cpu = self.wrapper = self.previous = None
+
+    def call(self, target):
+        """Runs a cached result for a JSR that has just been executed, or
+        starts recording the call"""
+        cpu = self.cpu
+        routine = self.routines.get(target)
+        if routine is None:
+            routine = self.routines[target] = Routine(self.max_entries)
+        elif routine.fetch_code(cpu.memory) != routine.code_bytes:
+            # The routine has been changed since it was profiled
+            routine.cache.clear()
+            routine.code_bytes = routine.fetch_code(cpu.memory)
+
+        key = routine.key(cpu)
+        outputs = routine.cache.get(key)
+        if outputs is None:
+            self.misses += 1
+            self.recording = Recording(cpu, target, routine)
+            return
+
+        self.hits += 1
+        routine.cache.move_to_end(key)
+        registers, writes, cycles = outputs
+        cpu.A, cpu.X, cpu.Y, cpu.P, cpu.SP, cpu.PC = registers
+        memory = cpu.memory
+        for address, value in writes:
+            memory[address] = value
+        cpu.cycle += cycles
+
+    def record(self, step, info):
+        """Steps the CPU through one instruction of the routine being
+        recorded, finishing the recording at its RTS"""
+        cpu, recording = self.cpu, self.recording
+        if cpu.PC != recording.pc or info.opcode in (BRK, RTI):
+            # An interrupt was run, so this call says nothing about the
+            # routine
+            self.abort(impure=False)
+            step(info)
+            return
+
+        recording.code.update(range(cpu.PC, cpu.PC + info.size))
+        memory = cpu.memory
+        cpu.memory = recording.memory
+        try:
+            step(info)
+        finally:
+            cpu.memory = memory
+        recording.steps += 1
+        recording.pc = cpu.PC
+
+        if recording.memory.io or recording.steps > MAX_STEPS:
+            self.abort(impure=True)
+        elif info.opcode == JSR:
+            recording.depth += 1
+        elif info.opcode == RTS:
+            recording.depth -= 1
+            if recording.depth < 0:
+                if cpu.SP == (recording.sp + 2) & 0xFF:
+                    self.finish()
+                else:
+                    self.abort(impure=True)
+
+    def abort(self, impure):
+        """Stops recording, optionally never memoizing the routine again"""
+        if impure:
+            self.forget(self.recording.target)
+        self.recording = None
+
+    def forget(self, target):
+        """Never memoizes the routine at target again"""
+        self.impure.add(target)
+        self.routines.pop(target, None)
+
+    def finish(self):
+        """Stores the result of a completed recording in the cache"""
+        cpu, recording = self.cpu, self.recording
+        routine = recording.routine
+        reads, writes = recording.memory.reads, recording.memory.writes
+        self.recording = None
+
+        if not recording.code.isdisjoint(writes):
+            # Self-modifying code can't be cached
+            self.forget(recording.target)
+            return
+
+        if not recording.code.issubset(routine.code):
+            routine.code = tuple(sorted(recording.code.union(routine.code)))
+            routine.fetch_code = gather(routine.code)
+        routine.code_bytes = routine.fetch_code(cpu.memory)
+
+        if not set(reads).issubset(routine.reads):
+            # Entries keyed on fewer inputs can't be looked up any more
+            routine.reads = tuple(sorted(set(reads).union(routine.reads)))
+            routine.read = gather(routine.reads)
+            routine.cache.clear()
+
+        inputs = []
+        for address in routine.reads:
+            if address in reads:
+                inputs.append(reads[address])
+            elif address in writes:
+                return # The value this call started with is lost
+            else:
+                inputs.append(cpu.memory[address])
+
+        registers = (cpu.A, cpu.X, cpu.Y, cpu.P, cpu.SP, cpu.PC)
+        routine.store(recording.registers + tuple(inputs),
+                      (registers, tuple(writes.items()),
+                       cpu.cycle - recording.cycle))
@@ -0,0 +1,41 @@
+; Hot loops for profiling superinstructions. hotloops.bin holds the bytes
+; below and runs forever from $C000:
+;
+;   python3 superinstructions.py programs/hotloops.bin
+;
+; Each frame draws a row of tiles, waits in a delay loop, counts up to a
+; limit and searches the row for a tile, like the main loop of a game.
+
+        .org $C000
+
+reset:  LDX #$FF                ; C000  A2 FF
+        TXS                     ; C002  9A
+
+frame:  LDA #$10                ; C003  A9 10      Draw the row
+        STA $0400               ; C005  8D 00 04
+        LDA #$11                ; C008  A9 11
+        STA $0401               ; C00A  8D 01 04
+        LDA #$12                ; C00D  A9 12
+        STA $0402               ; C00F  8D 02 04
+        LDA #$13                ; C012  A9 13
+        STA $0403               ; C014  8D 03 04
+        LDA #$00                ; C017  A9 00
+        STA $0404               ; C019  8D 04 04
+
+        LDX #$00                ; C01C  A2 00      Wait 256 iterations
+delay:  DEX                     ; C01E  CA
+        BNE delay               ; C01F  D0 FD
+
+        LDX #$00                ; C021  A2 00      Count to 32
+count:  INX                     ; C023  E8
+        CPX #$20                ; C024  E0 20
+        BNE count               ; C026  D0 FB
+
+        LDY #$00                ; C028  A0 00      Find tile $13
+find:   LDA $0400,Y             ; C02A  B9 00 04
+        INY                     ; C02D  C8
+        CMP #$13                ; C02E  C9 13
+        BNE find                ; C030  D0 F8
+
+        INC $10                 ; C032  E6 10      Next frame
+        JMP frame               ; C034  4C 03 C0
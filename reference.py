@@ -0,0 +1,217 @@
+"""An independent, table-driven model of the 6502 used to check the CPU.
+
+The model follows the same execution model as CPU.step: each instruction is
+handed over as an opcode and its operand bytes, and instructions that take a
+value (LDA, ADC, CMP, ...) use that operand directly. It shares no code with
+cpu.py so that a bug in one does not hide the same bug in the other."""
+
+# Status register bits
+C = 0x01 # Carry
+Z = 0x02 # Zero
+I = 0x04 # Interrupt disable
+D = 0x08 # Decimal mode
+B = 0x10 # Break
+U = 0x20 # Unused, always set
+V = 0x40 # Overflow
+N = 0x80 # Negative
+
+# Zero and negative flags for every byte value
+ZN = bytes((Z if v == 0 else 0) | (v & N) for v in range(256))
+
+
+class RefState():
+    """Registers, memory and cycle count of the reference model"""
+    def __init__(self, a, x, y, p, sp, pc, memory):
+        self.a  = a
+        self.x  = x
+        self.y  = y
+        self.p  = p
+        self.sp = sp
+        self.pc = pc
+        self.memory = bytearray(65536)
+        self.memory[0:len(memory)] = memory
+        self.cycle = 0
+
+    def registers(self):
+        """Returns the registers in the order used by fuzz.py"""
+        return (self.a, self.x, self.y, self.p, self.sp, self.pc, self.cycle)
+
+    def push(self, value):
+        self.memory[0x100 | self.sp] = value
+        self.sp = (self.sp - 1) & 0xFF
+
+    def pull(self):
+        self.sp = (self.sp + 1) & 0xFF
+        return self.memory[0x100 | self.sp]
+
+
+def _zn(s, value):
+    s.p = (s.p & ~(Z | N)) | ZN[value]
+
+def _compare(s, reg, value):
+    s.p = (s.p & ~(C | Z | N)) | ZN[(reg - value) & 0xFF] | (C if reg >= value else 0)
+
+def _lda(s, v): s.a = v; _zn(s, v)
+def _ldx(s, v): s.x = v; _zn(s, v)
+def _ldy(s, v): s.y = v; _zn(s, v)
+def _and(s, v): s.a &= v; _zn(s, s.a)
+def _ora(s, v): s.a |= v; _zn(s, s.a)
+def _eor(s, v): s.a ^= v; _zn(s, s.a)
+def _cmp(s, v): _compare(s, s.a, v)
+def _cpx(s, v): _compare(s, s.x, v)
+def _cpy(s, v): _compare(s, s.y, v)
+
+def _adc(s, v):
+    total = s.a + v + (s.p & C)
+    result = total & 0xFF
+    overflow = V if (~(s.a ^ v) & (s.a ^ result) & 0x80) else 0
+    s.p = (s.p & ~(C | V)) | (C if total > 0xFF else 0) | overflow
+    s.a = result
+    _zn(s, result)
+
+def _sta(s, v): s.memory[v] = s.a
+def _stx(s, v): s.memory[v] = s.x
+
+def _lda_x(s, v): _lda(s, s.memory[(v + s.x) & 0xFFFF])
+def _lda_y(s, v): _lda(s, s.memory[(v + s.y) & 0xFFFF])
+def _sta_x(s, v): s.memory[(v + s.x) & 0xFFFF] = s.a
+def _sta_y(s, v): s.memory[(v + s.y) & 0xFFFF] = s.a
+
+def _inc(s, v):
+    s.memory[v] = (s.memory[v] + 1) & 0xFF
+    _zn(s, s.memory[v])
+
+def _dec(s, v):
+    s.memory[v] = (s.memory[v] - 1) & 0xFF
+    _zn(s, s.memory[v])
+
+def _bit(s, v):
+    m = s.memory[v]
+    s.p = (s.p & ~(Z | V | N)) | (m & (V | N)) | (0 if s.a & m else Z)
+
+def _asl(s, v):
+    s.p = (s.p & ~C) | (s.a >> 7)
+    s.a = (s.a << 1) & 0xFF
+    _zn(s, s.a)
+
+def _lsr(s, v):
+    s.p = (s.p & ~C) | (s.a & 1)
+    s.a >>= 1
+    _zn(s, s.a)
+
+def _inx(s, v): s.x = (s.x + 1) & 0xFF; _zn(s, s.x)
+def _iny(s, v): s.y = (s.y + 1) & 0xFF; _zn(s, s.y)
+def _dex(s, v): s.x = (s.x - 1) & 0xFF; _zn(s, s.x)
+def _dey(s, v): s.y = (s.y - 1) & 0xFF; _zn(s, s.y)
+def _tax(s, v): s.x = s.a; _zn(s, s.x)
+def _tay(s, v): s.y = s.a; _zn(s, s.y)
+def _txa(s, v): s.a = s.x; _zn(s, s.a)
+def _tya(s, v): s.a = s.y; _zn(s, s.a)
+def _tsx(s, v): s.x = s.sp; _zn(s, s.x)
+def _txs(s, v): s.sp = s.x
+
+def _flag(mask, on):
+    if on:
+        return lambda s, v: setattr(s, 'p', s.p | mask)
+    return lambda s, v: setattr(s, 'p', s.p & ~mask)
+
+def _pha(s, v): s.push(s.a)
+def _php(s, v): s.push(s.p | B | U)
+def _pla(s, v): s.a = s.pull(); _zn(s, s.a)
+def _plp(s, v): s.p = (s.pull() & ~B) | U
+def _nop(s, v): pass
+
+# Control flow handlers return the new program counter
+
+def _branch(mask, taken_when_set):
+    def handler(s, v):
+        if bool(s.p & mask) == taken_when_set:
+            return (s.pc + 2 + (v - 256 if v & 0x80 else v)) & 0xFFFF
+        return (s.pc + 2) & 0xFFFF
+    return handler
+
+def _jmp(s, v):
+    return v
+
+def _jsr(s, v):
+    ret = (s.pc + 2) & 0xFFFF
+    s.push(ret >> 8)
+    s.push(ret & 0xFF)
+    return v
+
+def _brk(s, v):
+    ret = (s.pc + 2) & 0xFFFF
+    s.push(ret >> 8)
+    s.push(ret & 0xFF)
+    s.push(s.p | B | U)
+    s.p |= I
+    return s.memory[0xFFFE] | (s.memory[0xFFFF] << 8)
+
+def _rti(s, v):
+    s.p = (s.pull() & ~B) | U
+    low = s.pull()
+    high = s.pull()
+    return (high << 8) | low
+
+def _rts(s, v):
+    low = s.pull()
+    high = s.pull()
+    return (((high << 8) | low) + 1) & 0xFFFF
+
+
+# opcode: (name, size, cycles, handler, is_control_flow)
+OPS = {
+    0xA9: ("LDA", 2, 2, _lda, False), 0xA2: ("LDX", 2, 2, _ldx, False),
+    0xA0: ("LDY", 2, 2, _ldy, False), 0x29: ("AND", 2, 2, _and, False),
+    0x09: ("ORA", 2, 2, _ora, False), 0x49: ("EOR", 2, 2, _eor, False),
+    0x69: ("ADC", 2, 2, _adc, False), 0xC9: ("CMP", 2, 2, _cmp, False),
+    0xE0: ("CPX", 2, 2, _cpx, False), 0xC0: ("CPY", 2, 2, _cpy, False),
+    0x85: ("STA", 2, 3, _sta, False), 0x8D: ("STA", 3, 4, _sta, False),
+    0xBD: ("LDA", 3, 4, _lda_x, False), 0xB9: ("LDA", 3, 4, _lda_y, False),
+    0x9D: ("STA", 3, 5, _sta_x, False), 0x99: ("STA", 3, 5, _sta_y, False),
+    0x86: ("STX", 2, 3, _stx, False), 0x8E: ("STX", 3, 4, _stx, False),
+    0xE6: ("INC", 2, 5, _inc, False), 0xEE: ("INC", 3, 6, _inc, False),
+    0xC6: ("DEC", 2, 5, _dec, False), 0xCE: ("DEC", 3, 6, _dec, False),
+    0x24: ("BIT", 2, 3, _bit, False), 0x2C: ("BIT", 3, 4, _bit, False),
+    0x0A: ("ASL", 1, 2, _asl, False), 0x4A: ("LSR", 1, 2, _lsr, False),
+    0x18: ("CLC", 1, 2, _flag(C, False), False),
+    0x38: ("SEC", 1, 2, _flag(C, True), False),
+    0x78: ("SEI", 1, 2, _flag(I, True), False),
+    0x58: ("CLI", 1, 2, _flag(I, False), False),
+    0xD8: ("CLD", 1, 2, _flag(D, False), False),
+    0xF8: ("SED", 1, 2, _flag(D, True), False),
+    0xB8: ("CLV", 1, 2, _flag(V, False), False),
+    0x48: ("PHA", 1, 3, _pha, False), 0x08: ("PHP", 1, 3, _php, False),
+    0x68: ("PLA", 1, 4, _pla, False), 0x28: ("PLP", 1, 4, _plp, False),
+    0xE8: ("INX", 1, 2, _inx, False), 0xC8: ("INY", 1, 2, _iny, False),
+    0xCA: ("DEX", 1, 2, _dex, False), 0x88: ("DEY", 1, 2, _dey, False),
+    0xAA: ("TAX", 1, 2, _tax, False), 0xA8: ("TAY", 1, 2, _tay, False),
+    0x8A: ("TXA", 1, 2, _txa, False), 0x98: ("TYA", 1, 2, _tya, False),
+    0xBA: ("TSX", 1, 2, _tsx, False), 0x9A: ("TXS", 1, 2, _txs, False),
+    0xEA: ("NOP", 1, 2, _nop, False),
+    0x10: ("BPL", 2, 2, _branch(N, False), True),
+    0x30: ("BMI", 2, 2, _branch(N, True), True),
+    0x50: ("BVC", 2, 2, _branch(V, False), True),
+    0x70: ("BVS", 2, 2, _branch(V, True), True),
+    0x90: ("BCC", 2, 2, _branch(C, False), True),
+    0xB0: ("BCS", 2, 2, _branch(C, True), True),
+    0xD0: ("BNE", 2, 2, _branch(Z, False), True),
+    0xF0: ("BEQ", 2, 2, _branch(Z, True), True),
+    0x4C: ("JMP", 3, 3, _jmp, True),
+    0x20: ("JSR", 3, 6, _jsr, True),
+    0x60: ("RTS", 1, 6, _rts, True),
+    0x00: ("BRK", 1, 7, _brk, True),
+    0x40: ("RTI", 1, 6, _rti, True),
+}
+
+
+def execute(s, opcode, operand):
+    """Executes one instruction on a RefState"""
+    name, size, cycles, handler, control = OPS[opcode]
+    value = int.from_bytes(operand, 'little')
+    if control:
+        s.pc = handler(s, value)
+    else:
+        handler(s, value)
+        s.pc = (s.pc + size) & 0xFFFF
+    s.cycle += cycles
@@ -0,0 +1,140 @@
+"""Renders CHR ROM graphics from a GamePak into RGB frames.
+
+All 8x8 tiles in a CHR bank are decoded in one vectorized pass into a tile
+atlas, which is cached so that an unchanged bank is only ever decoded once.
+Pattern table and nametable views are then composed from the atlas with
+palette lookups, and can be written out as PNG or PPM without a display.
+
+Usage: python3 renderer.py ROM OUTPUT [BANK]   writes the pattern tables of
+a CHR bank to OUTPUT (.png or .ppm)"""
+import sys, zlib, struct
+import numpy as np
+
+TILE_BYTES = 16
+BANK_SIZE  = 8192
+
+# RGB values of the 64 colours the NES can display
+SYSTEM_PALETTE = np.array([
+    0x7C7C7C, 0x0000FC, 0x0000BC, 0x4428BC, 0x940084, 0xA80020, 0xA81000, 0x881400,
+    0x503000, 0x007800, 0x006800, 0x005800, 0x004058, 0x000000, 0x000000, 0x000000,
+    0xBCBCBC, 0x0078F8, 0x0058F8, 0x6844FC, 0xD800CC, 0xE40058, 0xF83800, 0xE45C10,
+    0xAC7C00, 0x00B800, 0x00A800, 0x00A844, 0x008888, 0x000000, 0x000000, 0x000000,
+    0xF8F8F8, 0x3CBCFC, 0x6888FC, 0x9878F8, 0xF878F8, 0xF85898, 0xF87858, 0xFCA044,
+    0xF8B800, 0xB8F818, 0x58D854, 0x58F898, 0x00E8D8, 0x787878, 0x000000, 0x000000,
+    0xFCFCFC, 0xA4E4FC, 0xB8B8F8, 0xD8B8F8, 0xF8B8F8, 0xF8A4C0, 0xF0D0B0, 0xFCE0A8,
+    0xF8D878, 0xD8F878, 0xB8F8B8, 0xB8F8D8, 0x00FCFC, 0xF8D8F8, 0x000000, 0x000000,
+], dtype=np.uint32)
+SYSTEM_PALETTE = np.stack([(SYSTEM_PALETTE >> 16) & 0xFF,
+                           (SYSTEM_PALETTE >> 8) & 0xFF,
+                           SYSTEM_PALETTE & 0xFF], axis=-1).astype(np.uint8)
+
+# Palette RAM used when none is given: four greys for every palette
+GREYS = bytes([0x0F, 0x00, 0x10, 0x30] * 8)
+
+
+def decode_tiles(chr_data):
+    """Decodes 2-bitplane CHR data into an (n, 8, 8) array of colour
+    indices 0-3. Each tile is 8 bytes of low bitplane followed by 8 bytes of
+    high bitplane, with the leftmost pixel in bit 7."""
+    data = np.frombuffer(chr_data, dtype=np.uint8)
+    planes = data[:len(data) - len(data) % TILE_BYTES].reshape(-1, 2, 8)
+    bits = np.unpackbits(planes[..., None], axis=-1)
+    return bits[:, 0] | (bits[:, 1] << 1)
+
+
+class Renderer():
+    """Composes frames from CHR data, caching decoded tile atlases"""
+    def __init__(self, chr_rom=b''):
+        self.chr_rom = chr_rom
+        self.atlases = {}
+
+    def atlas(self, bank=0):
+        """Returns the decoded tiles of an 8 KB CHR bank (512 tiles). The
+        last atlas of each bank is cached with the contents it was decoded
+        from, so CHR RAM can be passed in again after it changes and is only
+        then decoded again."""
+        data = bytes(self.chr_rom[bank * BANK_SIZE:(bank + 1) * BANK_SIZE])
+        if not data:
+            raise ValueError("CHR bank %d does not exist" % bank)
+        cached = self.atlases.get(bank)
+        if cached is not None and cached[0] == data:
+            return cached[1]
+        atlas = decode_tiles(data)
+        self.atlases[bank] = (data, atlas)
+        return atlas
+
+    def pattern_table(self, table=0, bank=0, palette=0, palette_ram=GREYS):
+        """Renders the 256 tiles of pattern table 0 or 1 as a 16x16 grid
+        (a 128x128 RGB frame) using one of the eight palettes"""
+        tiles = self.atlas(bank)[table * 256:(table + 1) * 256]
+        colours = np.frombuffer(bytes(palette_ram), dtype=np.uint8)
+        lookup = colours[[0, palette * 4 + 1, palette * 4 + 2, palette * 4 + 3]]
+        frame = tiles.reshape(16, 16, 8, 8).transpose(0, 2, 1, 3)
+        return SYSTEM_PALETTE[lookup[frame.reshape(128, 128)] & 0x3F]
+
+    def nametable(self, nametable, table=0, bank=0, palette_ram=GREYS):
+        """Renders a 1 KB nametable (960 tile indices followed by the 64 byte
+        attribute table) as a 256x240 RGB frame using the background
+        palettes in the first 16 bytes of palette RAM"""
+        names = np.frombuffer(bytes(nametable[:960]), dtype=np.uint8)
+        attributes = np.frombuffer(bytes(nametable[960:1024]),
+                                   dtype=np.uint8).reshape(8, 8)
+
+        # Each attribute byte holds the palettes of four 16x16 areas
+        rows = np.arange(30)[:, None]
+        cols = np.arange(32)[None, :]
+        shift = ((rows & 2) << 1) | (cols & 2)
+        palettes = (attributes[rows >> 2, cols >> 2] >> shift) & 3
+
+        tiles = self.atlas(bank)[table * 256 + names.reshape(30, 32).astype(int)]
+        indices = np.where(tiles == 0, 0, (palettes[:, :, None, None] << 2) | tiles)
+        colours = np.frombuffer(bytes(palette_ram), dtype=np.uint8)
+        frame = indices.transpose(0, 2, 1, 3).reshape(240, 256)
+        return SYSTEM_PALETTE[colours[frame] & 0x3F]
+
+
+def write_ppm(filename, frame):
+    """Writes an RGB frame as a binary PPM image"""
+    height, width = frame.shape[:2]
+    with open(filename, "wb") as f:
+        f.write(b"P6\n%d %d\n255\n" % (width, height))
+        f.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+
+
+def write_png(filename, frame):
+    """Writes an RGB frame as a PNG image"""
+    height, width = frame.shape[:2]
+    rows = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    rows[:, 1:] = frame.reshape(height, width * 3) # Filter byte 0 on each row
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data +
+                struct.pack(">I", zlib.crc32(kind + data)))
+
+    with open(filename, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(rows.tobytes())))
+        f.write(chunk(b"IEND", b""))
+
+
+def write_frame(filename, frame):
+    """Writes a frame as PNG or PPM depending on the file extension"""
+    if filename.lower().endswith(".ppm"):
+        write_ppm(filename, frame)
+    else:
+        write_png(filename, frame)
+
+
+if __name__ == '__main__':
+    from gamepak import GamePak
+    game = GamePak(sys.argv[1])
+    renderer = Renderer(game.chr_rom)
+    bank = int(sys.argv[3]) if len(sys.argv) >= 4 else 0
+    if len(game.chr_rom) <= bank * BANK_SIZE:
+        print("Error: the cartridge has no CHR ROM bank %d (it may use CHR "
+              "RAM)" % bank)
+        sys.exit(1)
+    frame = np.hstack([renderer.pattern_table(0, bank),
+                       renderer.pattern_table(1, bank)])
+    write_frame(sys.argv[2], frame)
@@ -0,0 +1,122 @@
+"""Exports CPU memory and registers through multiprocessing.shared_memory so
+that viewers and monitors in other processes can watch the emulator live.
+
+The block holds the 64 KB address space followed by a register block. The CPU
+uses the address space part directly as its memory, so writes cost nothing
+extra. Registers are only copied in by publish(), which is called between
+instructions or batches of instructions rather than on every write.
+
+A sequence counter at the start of the register block is odd while the
+emulator is running and even once registers have been published. A reader
+that sees the same even value before and after copying has a consistent
+snapshot.
+
+Usage: python3 shared.py NAME   prints the registers and stack page of a
+running emulator started with `python3 main.py --shared NAME`"""
+import os, sys, time, struct
+from multiprocessing import shared_memory, resource_tracker
+
+MEMORY_SIZE = 65536
+
+# Sequence counter, then PC, A, X, Y, P, SP and the cycle count
+SEQ = struct.Struct('<I')
+REGISTERS = struct.Struct('<IHBBBBBxQ')
+REGISTER_NAMES = ('PC', 'A', 'X', 'Y', 'P', 'SP', 'cycle')
+SIZE = MEMORY_SIZE + REGISTERS.size
+
+# Python 3.13 can map a block without registering it with the resource
+# tracker. Before that, POSIX blocks are registered under their name with a
+# leading slash and have to be unregistered by hand.
+UNTRACKED = sys.version_info >= (3, 13)
+TRACKER_PREFIX = "/" if os.name == "posix" else None
+
+# Names of the blocks created by this process, whose tracker entries belong
+# to their SharedState
+CREATED = set()
+
+
+class SharedState():
+    """Creates a shared memory block for a CPU to use as its memory"""
+    def __init__(self, name=None):
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=SIZE)
+        self.name = self.shm.name
+        CREATED.add(self.name)
+        self.memory = self.shm.buf[:MEMORY_SIZE]
+        self.seq = 0
+
+    def begin(self):
+        """Marks the registers as stale before the CPU starts running"""
+        if not self.seq & 1:
+            self.seq += 1
+            SEQ.pack_into(self.shm.buf, MEMORY_SIZE, self.seq)
+
+    def publish(self, cpu):
+        """Copies the CPU's registers into the register block"""
+        self.begin()
+        REGISTERS.pack_into(self.shm.buf, MEMORY_SIZE, self.seq, cpu.PC,
+                            cpu.A, cpu.X, cpu.Y, cpu.P, cpu.SP, cpu.cycle)
+        self.seq += 1
+        SEQ.pack_into(self.shm.buf, MEMORY_SIZE, self.seq)
+
+    def close(self):
+        """Releases and removes the shared memory block. The CPU using it
+        can no longer access its memory afterwards."""
+        self.memory.release()
+        self.shm.close()
+        self.shm.unlink()
+        CREATED.discard(self.name)
+
+
+class SharedStateReader():
+    """Maps a SharedState created by another process read-only"""
+    def __init__(self, name):
+        # Only the creator should remove the block when it exits
+        if UNTRACKED:
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            if TRACKER_PREFIX is not None and self.shm.name not in CREATED:
+                resource_tracker.unregister(TRACKER_PREFIX + self.shm.name,
+                                            'shared_memory')
+        self.buf = self.shm.buf.toreadonly()
+        self.memory = self.buf[:MEMORY_SIZE]
+        self.stack = self.memory[0x100:0x200]
+
+    def seq(self):
+        """Returns the current sequence counter"""
+        return SEQ.unpack_from(self.buf, MEMORY_SIZE)[0]
+
+    def registers(self, retries=1000):
+        """Returns a consistent dict of the last published registers"""
+        return self.snapshot(retries, copy_memory=False)[0]
+
+    def snapshot(self, retries=1000, copy_memory=True):
+        """Returns the registers and a copy of memory, retrying until both
+        were read while the emulator was stopped"""
+        for _ in range(retries):
+            before = self.seq()
+            if before & 1:
+                time.sleep(0)
+                continue
+            values = REGISTERS.unpack_from(self.buf, MEMORY_SIZE)[1:]
+            memory = bytes(self.memory) if copy_memory else None
+            if self.seq() == before:
+                return dict(zip(REGISTER_NAMES, values)), memory
+        raise TimeoutError("Emulator did not stop running")
+
+    def close(self):
+        """Unmaps the shared memory block"""
+        self.stack.release()
+        self.memory.release()
+        self.buf.release()
+        self.shm.close()
+
+
+if __name__ == '__main__':
+    reader = SharedStateReader(sys.argv[1])
+    registers, memory = reader.snapshot()
+    print("PC:%04x A:%02x X:%02x Y:%02x P:%02x SP:%02x CYC:%d" %
+          tuple(registers[n] for n in REGISTER_NAMES))
+    for row in range(0x100, 0x200, 16):
+        print("%04x  %s" % (row, memory[row:row + 16].hex(' ')))
+    reader.close()
@@ -0,0 +1,34 @@
+"""Opcode sequences fused by superinstructions.py, with the number of times
+each ran in the profile it was chosen from.
+
+Generated by `python3 superinstructions.py programs/hotloops.bin`, do not edit."""
+
+SEQUENCES = [
+    ((0xCA, 0xD0), 40087), # DEX BNE
+    ((0xE8, 0xE0, 0xD0), 4992), # INX CPX BNE
+    ((0xE8, 0xE0), 4992), # INX CPX
+    ((0xE0, 0xD0), 4992), # CPX BNE
+    ((0xA9, 0x8D, 0xA9), 628), # LDA STA LDA
+    ((0x8D, 0xA9, 0x8D), 628), # STA LDA STA
+    ((0xB9, 0xC8, 0xC9), 624), # LDA INY CMP
+    ((0xC8, 0xC9, 0xD0), 624), # INY CMP BNE
+    ((0xA9, 0x8D), 785), # LDA STA
+    ((0x8D, 0xA9), 628), # STA LDA
+    ((0xB9, 0xC8), 624), # LDA INY
+    ((0xC8, 0xC9), 624), # INY CMP
+    ((0xC9, 0xD0), 624), # CMP BNE
+    ((0xA9, 0x8D, 0xA2), 157), # LDA STA LDX
+    ((0x8D, 0xA2, 0xCA), 157), # STA LDX DEX
+    ((0xA2, 0xCA, 0xD0), 157), # LDX DEX BNE
+    ((0xA2, 0xE8, 0xE0), 156), # LDX INX CPX
+    ((0xA0, 0xB9, 0xC8), 156), # LDY LDA INY
+    ((0x8D, 0xA2), 157), # STA LDX
+    ((0xA2, 0xCA), 157), # LDX DEX
+    ((0xA2, 0xE8), 156), # LDX INX
+    ((0xA0, 0xB9), 156), # LDY LDA
+    ((0xE6, 0x4C), 156), # INC JMP
+    ((0xA2, 0x9A, 0xA9), 1), # LDX TXS LDA
+    ((0x9A, 0xA9, 0x8D), 1), # TXS LDA STA
+    ((0xA2, 0x9A), 1), # LDX TXS
+    ((0x9A, 0xA9), 1), # TXS LDA
+]
@@ -0,0 +1,265 @@
+"""Fuses frequently executed runs of instructions into single handlers.
+
+Hot loops spend much of their time on the work CPU.run does around each
+instruction: fetching it, building an Info and dispatching through
+CPU.step. A Superinstructions table caches decoded instructions by address
+and, where the code at an address starts with one of a set of opcode
+sequences (such as LDA #imm; STA abs or DEX; BNE), runs the whole sequence
+from one handler with its cycles added in one go. Cached code is compared
+with memory before it is run, so code that changes is decoded again.
+
+Which sequences are worth fusing is decided by profiling real programs.
+The chosen set lives in superinstruction_table.py, which is generated from
+a profile of programs/hotloops.bin with
+
+Usage: python3 superinstructions.py FILE [FILE ...]   profiles each .nes ROM
+or raw program loaded at $C000 from $C000 and rewrites
+superinstruction_table.py"""
+import sys
+from collections import Counter
+from cpu import *
+from cpu_constants import *
+from loops import recognize
+
+# Number of sequences kept when a table is generated
+TABLE_SIZE = 32
+
+# Instructions run when profiling each program
+PROFILE_STEPS = 100000
+
+TABLE_FILE = "superinstruction_table.py"
+
+# Instructions that change the program counter, or may cut a CPU.run batch
+# short, can only be the last of a sequence
+ENDS_SEQUENCE = frozenset((0x10, 0x30, 0x50, 0x70, 0x90, 0xB0, 0xD0, 0xF0,
+                           0x4C, 0x6C, 0x20, 0x60, 0x00, 0x40, 0x58, 0x28))
+
+STACK_PAGE = range(0x100, 0x200)
+
+
+def fusable(opcode):
+    """Checks if an opcode can be part of a sequence"""
+    return callable(instr_functions[opcode]) and instr_sizes[opcode] > 0
+
+
+class Superinstruction():
+    """One or more decoded instructions that are run by a single handler"""
+    def __init__(self, code, infos):
+        self.code = code             # Bytes the instructions were decoded from
+        self.length = len(code)
+        self.count = len(infos)
+        self.first = self if self.count == 1 else None
+        self.handler = self.build(infos)
+
+    @staticmethod
+    def build(infos):
+        """Returns a function that runs the instructions on a CPU"""
+        body = [(instr_functions[info.opcode], info) for info in infos[:-1]]
+        advance = sum(info.size for info in infos[:-1])
+        last = infos[-1]
+        function, size = instr_functions[last.opcode], last.size
+        cycles = sum(instr_cycles[info.opcode] for info in infos)
+
+        if not body:
+            def handler(cpu):
+                cpu.pc_set = False
+                function(cpu, last)
+                cpu.cycle += cycles
+                if not cpu.pc_set:
+                    cpu.PC = (cpu.PC + size) & 0xFFFF
+            return handler
+
+        # Only the last instruction can look at the program counter
+        def handler(cpu):
+            for body_function, info in body:
+                body_function(cpu, info)
+            cpu.PC = (cpu.PC + advance) & 0xFFFF
+            cpu.pc_set = False
+            function(cpu, last)
+            cpu.cycle += cycles
+            if not cpu.pc_set:
+                cpu.PC = (cpu.PC + size) & 0xFFFF
+        return handler
+
+
+class Superinstructions():
+    """A decoded instruction cache that fuses the given opcode sequences
+    and, unless loops is False, runs fill and copy loops in bulk"""
+    def __init__(self, sequences=None, loops=True):
+        if sequences is None:
+            from superinstruction_table import SEQUENCES
+            sequences = [sequence for sequence, count in SEQUENCES]
+        self.sequences = frozenset(tuple(s) for s in sequences)
+        self.longest = max(map(len, self.sequences), default=1)
+        self.loops = loops
+        self.cache = {}
+        self.cpu = None
+
+    def attach(self, cpu):
+        """Makes CPU.run use the table. CPUs with a wrapped step, such as
+        one with a CoverageMap attached, keep running one instruction at a
+        time."""
+        cpu.superinstructions = self
+        self.cpu = cpu
+
+    def detach(self):
+        """Stops CPU.run using the table"""
+        self.cpu.superinstructions = None
+        self.cpu = None
+        self.cache.clear()
+
+    def decode(self, memory, pc):
+        """Decodes the instructions at pc, fusing the longest known
+        sequence they start with"""
+        opcode = memory[pc]
+        size = instr_sizes[opcode]
+        infos = [Info(opcode, size, bytes(memory[pc + 1:pc + size]), 'little')]
+        end = pc + size
+        while len(infos) < self.longest and end < 0x10000 and \
+                fusable(opcode) and opcode not in ENDS_SEQUENCE:
+            opcode = memory[end]
+            size = instr_sizes[opcode]
+            if not fusable(opcode) or end + size > 0x10000:
+                break
+            infos.append(Info(opcode, size, bytes(memory[end + 1:end + size]),
+                              'little'))
+            end += size
+
+        while len(infos) > 1 and not self.safe(pc, infos):
+            infos.pop()
+
+        entry = Superinstruction(bytes(memory[pc:pc + infos[0].size]), infos[:1])
+        loop = recognize(memory, pc, entry) if self.loops else None
+        if loop is not None:
+            return loop
+        if len(infos) > 1:
+            length = sum(info.size for info in infos)
+            fused = Superinstruction(bytes(memory[pc:pc + length]), infos)
+            fused.first = entry
+            entry = fused
+        return entry
+
+    def safe(self, pc, infos):
+        """Checks if infos is a known sequence that can be run in one go:
+        none of the instructions before the last may be able to write to the
+        code of the sequence or to a stack page it lies in"""
+        if tuple(info.opcode for info in infos) not in self.sequences:
+            return False
+        code = range(pc, pc + sum(info.size for info in infos))
+        if code.start < STACK_PAGE.stop and code.stop > STACK_PAGE.start:
+            return False
+        for info in infos[:-1]:
+            function = instr_functions[info.opcode]
+            if function in (CPU.sta, CPU.stx, CPU.inc, CPU.dec):
+                if info.value in code:
+                    return False
+            elif function in (CPU.sta_x, CPU.sta_y):
+                # Indexed stores can reach up to 255 bytes past their base
+                if any((info.value + index) & 0xFFFF in code
+                       for index in range(256)):
+                    return False
+        return True
+
+    def lookup(self, cpu):
+        """Returns the decoded instructions at the CPU's program counter"""
+        pc, memory = cpu.PC, cpu.memory
+        entry = self.cache.get(pc)
+        if entry is None or memory[pc:pc + entry.length] != entry.code:
+            entry = self.cache[pc] = self.decode(memory, pc)
+        return entry
+
+    def execute(self, cpu, budget=0):
+        """Runs the instructions at the program counter, returning how many
+        were run. Loops may run up to budget more instructions."""
+        entry = self.lookup(cpu)
+        saved, cpu.budget = cpu.budget, budget
+        try:
+            entry.handler(cpu)
+            return entry.count + budget - cpu.budget
+        finally:
+            cpu.budget = saved
+
+    def run_batch(self, cpu):
+        """Runs instructions until the CPU's batch budget is used up"""
+        lookup = self.lookup
+        while cpu.budget > 0:
+            entry = lookup(cpu)
+            if entry.count > cpu.budget:
+                entry = entry.first
+            cpu.budget -= entry.count
+            entry.handler(cpu)
+
+
+def profile(cpu, count, counts=None):
+    """Runs count instructions, counting how often each sequence of two or
+    three instructions that could be fused was executed"""
+    counts = Counter() if counts is None else counts
+    history = []
+    step = cpu.step
+
+    def profiled_step(info):
+        pc = cpu.PC
+        step(info)
+        if history and (not fusable(info.opcode) or
+                        history[-1][1] != pc or
+                        history[-1][0] in ENDS_SEQUENCE):
+            history.clear()
+        if not fusable(info.opcode):
+            return
+        history.append((info.opcode, (pc + info.size) & 0xFFFF))
+        del history[:-3]
+        opcodes = tuple(opcode for opcode, _ in history)
+        for length in range(2, len(opcodes) + 1):
+            counts[opcodes[-length:]] += 1
+
+    previous = cpu.wrap_step(profiled_step)
+    try:
+        cpu.run(count)
+    except TypeError:
+        pass # Stopped on an incomplete instruction
+    finally:
+        cpu.unwrap_step(profiled_step, previous)
+    return counts
+
+
+def choose(counts, size=TABLE_SIZE):
+    """Picks the sequences that save the most dispatches, returning them
+    with their counts"""
+    def saved(item):
+        sequence, count = item
+        return count * (len(sequence) - 1)
+    return sorted(counts.items(), key=saved, reverse=True)[:size]
+
+
+def write_table(filename, chosen, sources):
+    """Writes chosen sequences out as a Python module"""
+    with open(filename, "w") as f:
+        f.write('"""Opcode sequences fused by superinstructions.py, with the '
+                'number of times\neach ran in the profile it was chosen '
+                'from.\n\nGenerated by `python3 superinstructions.py %s`, '
+                'do not edit."""\n\nSEQUENCES = [\n' % " ".join(sources))
+        for sequence, count in chosen:
+            opcodes = ", ".join("0x%02X" % opcode for opcode in sequence)
+            names = " ".join(instr_names[opcode] for opcode in sequence)
+            f.write("    ((%s), %d), # %s\n" % (opcodes, count, names))
+        f.write("]\n")
+
+
+if __name__ == '__main__':
+    from gamepak import GamePak
+    counts = Counter()
+    for filename in sys.argv[1:]:
+        cpu = CPU()
+        if filename.endswith(".nes"):
+            game = GamePak(filename)
+            for bank in range(0x8000, 0x10000, len(game.prg_rom)):
+                cpu.load(bank, game.prg_rom)
+        else:
+            with open(filename, "rb") as f:
+                cpu.load(0xC000, f.read())
+        profile(cpu, PROFILE_STEPS, counts)
+
+    chosen = choose(counts)
+    write_table(TABLE_FILE, chosen, sys.argv[1:])
+    for sequence, count in chosen:
+        print("%8d  %s" % (count, " ".join(instr_names[o] for o in sequence)))
@@ -0,0 +1,52 @@
+import io, os, unittest, tempfile, contextlib
+from cpu import *
+from cli import *
+
+class TestMemoryCommands(unittest.TestCase):
+    def setUp(self):
+        self.cpu = CPU()
+        self.cli = CLI(self.cpu)
+        self.cli.paging = False
+
+    def run_command(self, line):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            inp = line.split()
+            self.cli.cli_funcs[inp[0]](inp)
+        return out.getvalue()
+
+    def test_dump(self):
+        """mem START END prints a hexdump with ASCII"""
+        self.cpu.load(0x0200, b'Hi\x00')
+        lines = self.run_command("mem 0200 $0211").splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0], "0200  48 69" + " 00" * 14 + "  Hi" + "." * 14)
+        self.assertEqual(lines[1], "0210  00 00" + " " * 42 + "  ..")
+
+    def test_fill_and_find(self):
+        """fill sets a range and find reports every match"""
+        self.run_command("fill 0300 0303 a9")
+        self.assertEqual(self.cpu.memory[0x2FF:0x305], b'\x00\xa9\xa9\xa9\xa9\x00')
+        out = self.run_command("find a9 a9")
+        self.assertEqual(out, "3 matches\n0300 0301 0302\n")
+        self.assertEqual(self.run_command("find 12 34"), "Pattern not found\n")
+
+    def test_load(self):
+        """load copies a file into memory and checks that it fits"""
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'data.bin')
+            with open(filename, 'wb') as f:
+                f.write(b'\x01\x02\x03')
+            self.run_command("load %s fffd" % filename)
+            self.assertEqual(self.cpu.memory[0xFFFD:], b'\x01\x02\x03')
+            out = self.run_command("load %s fffe" % filename)
+            self.assertTrue(out.startswith("Error"))
+
+    def test_errors(self):
+        """Bad arguments print an error instead of raising"""
+        for line in ("mem 10000", "mem zz", "mem 0300 0200", "fill 0300", "fill 0300 0200 00",
+                     "find", "find xyz", "load"):
+            self.assertTrue(self.run_command(line).startswith("Error"), line)
+
+if __name__ == '__main__':
+    unittest.main()
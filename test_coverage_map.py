@@ -0,0 +1,75 @@
+import os, unittest, tempfile
+from cpu import *
+from coverage_map import *
+
+class TestCoverageMap(unittest.TestCase):
+    def setUp(self):
+        self.cpu = CPU()
+        self.cpu.load(0xC000, bytes([0xA2, 0x00,   # LDX #$00
+                                     0xE0, 0x05,   # CPX #$05
+                                     0xD0, 0x02,   # BNE $C008
+                                     0xB0, 0x00,   # BCS $C008
+                                     0xEA, 0x00])) # NOP, BRK
+        self.coverage = CoverageMap()
+        self.coverage.attach(self.cpu)
+
+    def test_run(self):
+        """Executed addresses and branch outcomes are recorded from run"""
+        self.cpu.run(4)
+        self.assertEqual(self.coverage.summary(), (4, 1, 0))
+        self.assertTrue(check_address(self.coverage.executed, 0xC004))
+        self.assertFalse(check_address(self.coverage.executed, 0xC006))
+        self.assertTrue(check_address(self.coverage.taken, 0xC004))
+
+        lines = self.coverage.listing(self.cpu.memory, 0xC000, 0xC009)
+        self.assertEqual(lines[2], "* C004  D0 02     BNE $C008      always taken")
+        self.assertEqual(lines[3], "  C006  B0 00     BCS $C008")
+        self.assertEqual(lines[4], "* C008  EA        NOP")
+
+    def test_step(self):
+        """Coverage also works for CPUs driven one step at a time"""
+        self.cpu.load(0xC003, bytes([0x00]))     # CPX #$00, so BNE falls through
+        for _ in range(3):
+            self.cpu.step(self.cpu.fetch())
+        self.assertTrue(check_address(self.coverage.not_taken, 0xC004))
+        lines = self.coverage.listing(self.cpu.memory, 0xC004, 0xC005)
+        self.assertTrue(lines[0].endswith("never taken"))
+
+    def test_changed_code(self):
+        """Executed addresses that now hold a branch are still listed"""
+        self.cpu.load(0xC000, bytes([0xEA, 0xEA]))  # NOP, NOP
+        self.cpu.run(2)
+        self.cpu.memory[0xC000] = 0xD0             # BNE
+        lines = self.coverage.listing(self.cpu.memory, 0xC000, 0xC001)
+        self.assertTrue(lines[0].endswith("outcome unknown"))
+
+    def test_save_load(self):
+        """Maps survive a round trip through a file, and detaching stops
+        recording"""
+        self.cpu.run(3)
+        self.coverage.detach()
+        self.cpu.run(2)
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'nestest.cov')
+            self.coverage.save(filename)
+            loaded = CoverageMap.load(filename)
+        self.assertEqual(loaded.executed, self.coverage.executed)
+        self.assertEqual(loaded.summary(), (3, 1, 0))
+
+    def test_stacked_detach(self):
+        """Detaching restores the wrapper underneath, and only the
+        outermost wrapper can be detached"""
+        inner = CoverageMap()
+        self.coverage.detach()
+        inner.attach(self.cpu)
+        self.coverage.attach(self.cpu)
+        with self.assertRaises(RuntimeError):
+            inner.detach()
+        self.coverage.detach()
+        self.cpu.run(3)
+        self.assertEqual(inner.summary()[0], 3)
+        inner.detach()
+        self.assertNotIn('step', vars(self.cpu))
+
+if __name__ == '__main__':
+    unittest.main()
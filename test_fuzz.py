@@ -0,0 +1,42 @@
+import unittest
+from cpu import *
+import fuzz
+
+class BrokenCPU(CPU):
+    """A CPU with the old BMI bug, which added to P instead of PC"""
+    def step(self, info):
+        if info.opcode == 0x30:
+            self.pc_set = False
+            if check_bit(self.P, 7):
+                self.P += info.value
+            self.cycle += instr_cycles[info.opcode]
+            self.PC = (self.PC + info.size) & 0xFFFF
+        else:
+            CPU.step(self, info)
+
+class TestFuzz(unittest.TestCase):
+    def test_cpu_matches_reference(self):
+        """Runs a fixed batch of random cases against the reference model"""
+        count, failures = fuzz.run_chunk((1234, 2000, 16))
+        self.assertEqual(count, 2000)
+        self.assertEqual([(str(c), m) for c, m in failures], [])
+
+    def test_shrink(self):
+        """Finds the BMI bug and shrinks it down to a couple of instructions"""
+        cpu = BrokenCPU()
+        failures = []
+        seed = 0
+        while not failures:
+            rng = fuzz.random.Random(seed)
+            case = fuzz.random_case(rng, 16)
+            if fuzz.check(cpu, case) is not None:
+                failures.append(case)
+            seed += 1
+
+        case = fuzz.shrink(cpu, failures[0])
+        self.assertLessEqual(len(case.program), 2)
+        self.assertEqual(case.program[-1][0], 0x30)
+        self.assertIsNotNone(fuzz.check(cpu, case))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+from cpu import *
+
+class TestInterrupts(unittest.TestCase):
+    def setUp(self):
+        self.cpu = CPU()
+        self.cpu.load(NMI_VECTOR, bytes([0x00, 0x90, 0x00, 0x80, 0x00, 0xA0]))
+        self.cpu.load(0x9000, bytes([0xEA, 0x40])) # NMI handler: NOP, RTI
+        self.cpu.load(0xA000, bytes([0xE6, 0x10,   # IRQ handler: INC $10
+                                     0x40]))       # RTI
+        self.cpu.load(0xC000, bytes([0xEA] * 64))  # NOPs
+
+    def test_nmi(self):
+        """An NMI is run once, pushing PC and P, and RTI returns from it"""
+        self.cpu.run(2)
+        self.cpu.raise_nmi()
+        self.cpu.run(1)
+        self.assertEqual(self.cpu.PC, 0x9001)
+        self.assertEqual(self.cpu.SP, 0xFA)
+        self.assertEqual(self.cpu.memory[0x1FD], 0xC0)
+        self.assertEqual(self.cpu.memory[0x1FC], 0x02)
+        self.assertEqual(self.cpu.memory[0x1FB], 0x24 | 0x20)
+        self.assertTrue(check_bit(self.cpu.P, 2))
+        self.assertEqual(self.cpu.pending, 0)
+
+        self.cpu.P = clear_bit(self.cpu.P, 2)
+        self.cpu.run(1)
+        self.assertEqual(self.cpu.PC, 0xC002)
+        self.assertTrue(check_bit(self.cpu.P, 2)) # I restored by RTI
+
+    def test_irq_masked(self):
+        """IRQs wait while I is set, run after CLI plus one instruction, and
+        keep running until the line is released"""
+        self.cpu.raise_irq()
+        self.cpu.run(3)
+        self.assertEqual(self.cpu.PC, 0xC003)
+
+        self.cpu.load(0xC003, bytes([0x58]))       # CLI
+        self.cpu.run(10)                           # CLI, NOP, 4x (INC, RTI)
+        self.assertEqual(self.cpu.memory[0x1FC], 0x05)
+        self.assertEqual(self.cpu.memory[0x10], 4)
+        self.assertEqual(self.cpu.PC, 0xC005)
+
+        self.cpu.clear_irq()
+        self.cpu.run(1)
+        self.assertEqual(self.cpu.PC, 0xC006)
+        self.assertEqual(self.cpu.memory[0x10], 4)
+
+    def test_irq_delay_across_batches(self):
+        """The instruction after CLI runs before the IRQ even when CLI is
+        the last instruction of a batch"""
+        results = []
+        for batch in (1, 2, 3, 4, 5, BATCH_SIZE):
+            self.setUp()
+            self.cpu.load(0xC003, bytes([0x58]))   # CLI
+            self.cpu.run(3)
+            self.cpu.raise_irq()
+            self.assertEqual(self.cpu.run(5, batch=batch), 5)
+            self.assertEqual(self.cpu.memory[0x1FC], 0x05, batch)
+            results.append((self.cpu.PC, self.cpu.memory[0x10], self.cpu.cycle))
+        self.assertEqual(results, [results[0]] * len(results))
+
+    def test_batch_preempted(self):
+        """Raising an interrupt mid-batch does not lose instructions"""
+        calls = []
+        step = self.cpu.step
+        def raising_step(info):
+            step(info)
+            calls.append(self.cpu.PC)
+            if len(calls) == 3:
+                self.cpu.raise_nmi()
+        self.cpu.step = raising_step
+
+        self.assertEqual(self.cpu.run(10, batch=8), 10)
+        self.assertEqual(len(calls), 10)
+        self.assertEqual(calls[3], 0x9001) # Handler ran straight after
+
+    def test_brk(self):
+        """BRK pushes P with the break flag and jumps through the IRQ
+        vector; RTI clears the break flag again"""
+        self.cpu.load(0xC000, bytes([0x00, 0xFF]))
+        self.cpu.run(1)
+        self.assertEqual(self.cpu.PC, 0xA000)
+        self.assertEqual(self.cpu.memory[0x1FB], 0x24 | 0x30)
+        self.cpu.run(2)
+        self.assertEqual(self.cpu.PC, 0xC002)
+        self.assertEqual(self.cpu.P, 0x24)
+        self.assertEqual(self.cpu.memory[0x10], 1)
+
+if __name__ == '__main__':
+    unittest.main()
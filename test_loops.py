@@ -0,0 +1,82 @@
+import unittest
+from cpu import *
+from superinstructions import Superinstructions
+from testing import CPUTestCase, make_cpu
+
+# Clears $0200-$03FF, then copies $40 bytes from $C100 to $0340-$037F
+# backwards, then loops forever
+PROGRAM = bytes([0xA9, 0x00,         # C000 LDA #$00
+                 0xA2, 0x00,         # C002 LDX #$00
+                 0x9D, 0x00, 0x02,   # C004 STA $0200,X
+                 0x9D, 0x00, 0x03,   # C007 STA $0300,X
+                 0xE8,               # C00A INX
+                 0xD0, 0xF7,         # C00B BNE $C004
+                 0xA0, 0x7F,         # C00D LDY #$7F
+                 0xB9, 0xC0, 0xC0,   # C00F LDA $C0C0,Y
+                 0x99, 0x00, 0x03,   # C012 STA $0300,Y
+                 0x88,               # C015 DEY
+                 0xC0, 0x3F,         # C016 CPY #$3F
+                 0xD0, 0xF5,         # C018 BNE $C00F
+                 0x4C, 0x1A, 0xC0])  # C01A JMP $C01A
+
+def blocks(program=PROGRAM):
+    """Returns the program, the data it copies and RAM to clear"""
+    return ((0xC000, program), (0xC100, bytes(range(0x80, 0xC0))),
+            (0x200, b'\xAA' * 0x200))
+
+class TestLoops(CPUTestCase):
+    def setUp(self):
+        self.cpu = make_cpu(*blocks())
+        self.fused = Superinstructions([])
+        self.fused.attach(self.cpu)
+
+    def test_run(self):
+        """Bulk loops leave the CPU as iterating does, including when the
+        budget runs out part way through a loop"""
+        plain = make_cpu(*blocks())
+        for count in (2, 3, 50, 1000, 20, 300, 5000):
+            self.assertEqual(self.cpu.run(count, batch=97), plain.run(count, batch=97))
+            self.assertSameState(self.cpu, plain)
+        self.assertEqual(self.cpu.memory[0x200:0x340], bytes(0x140))
+        self.assertEqual(self.cpu.memory[0x340:0x380], bytes(range(0x80, 0xC0)))
+
+    def test_bulk(self):
+        """Whole loops are run by one execute call"""
+        self.cpu.run(2)
+        self.assertEqual(self.fused.execute(self.cpu, 10000), 256 * 4)
+        self.assertEqual(self.cpu.PC, 0xC00D)
+        self.cpu.run(1)
+        self.assertEqual(self.fused.execute(self.cpu, 10000), 0x40 * 5)
+        self.assertEqual(self.cpu.PC, 0xC01A)
+        self.assertEqual((self.cpu.A, self.cpu.Y, self.cpu.P), (0x80, 0x3F, 0x27))
+
+    def test_wrap(self):
+        """Index values that wrap around are split into two ranges"""
+        program = bytearray(PROGRAM)
+        program[0x03] = 0xF0                # LDX #$F0
+        program[0x0E] = 0x10                # LDY #$10
+        program[0x17] = 0xD0                # CPY #$D0
+        plain = make_cpu(*blocks(program))
+        self.cpu.load(0xC000, program)
+        self.assertEqual(self.cpu.run(2000), plain.run(2000))
+        self.assertSameState(self.cpu, plain)
+
+    def test_fallback(self):
+        """Loops storing to I/O registers or the cartridge, or copying
+        between overlapping ranges, run one instruction at a time"""
+        self.cpu.run(2)
+        for address in (0x20, 0xFF):        # STA $2000,X / STA $FF00,X
+            self.cpu.memory[0xC009] = address
+            self.assertEqual(self.fused.execute(self.cpu, 10000), 1)
+            self.cpu.PC = 0xC004
+
+        self.cpu.PC = 0xC00F
+        self.cpu.Y = 0x7F
+        self.cpu.memory[0xC014] = 0xC1      # STA $C100,Y
+        self.assertEqual(self.fused.execute(self.cpu, 10000), 1)
+        self.cpu.memory[0xC014] = 0x03
+        self.cpu.memory[0xC010:0xC012] = bytes([0x20, 0x03]) # LDA $0320,Y
+        self.assertEqual(self.fused.execute(self.cpu, 10000), 1)
+
+if __name__ == '__main__':
+    unittest.main()
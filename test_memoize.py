@@ -0,0 +1,99 @@
+import unittest
+from cpu import *
+from memoize import *
+from testing import CPUTestCase, make_cpu
+
+PROGRAM = bytes([0xA2, 0x00,         # C000 LDX #$00
+                 0x20, 0x00, 0xD0,   # C002 JSR $D000
+                 0x20, 0x00, 0xD0,   # C005 JSR $D000
+                 0x20, 0x10, 0xD0,   # C008 JSR $D010
+                 0x4C, 0x02, 0xC0])  # C00B JMP $C002
+
+ROUTINE = bytes([0xE6, 0x10,         # D000 INC $10
+                 0x20, 0x10, 0xD0,   # D002 JSR $D010
+                 0x48,               # D005 PHA
+                 0x68,               # D006 PLA
+                 0xA0, 0x07,         # D007 LDY #$07
+                 0x60])              # D009 RTS
+
+INNER = bytes([0xC6, 0x11,           # D010 DEC $11
+               0x60])                # D012 RTS
+
+BLOCKS = ((0xC000, PROGRAM), (0xD000, ROUTINE), (0xD010, INNER))
+
+def run_until(cpu, pc, times):
+    """Runs the CPU until it has reached pc the given number of times"""
+    while True:
+        cpu.run(1)
+        if cpu.PC == pc:
+            times -= 1
+            if times == 0:
+                return
+
+class TestMemoize(CPUTestCase):
+    def setUp(self):
+        self.cpu = make_cpu(*BLOCKS)
+        self.memoizer = SubroutineMemoizer()
+        self.memoizer.attach(self.cpu)
+
+    def test_same_results(self):
+        """Memoized calls leave the CPU exactly as running them would"""
+        plain = make_cpu(*BLOCKS)
+        for times in (1, 2, 20):
+            run_until(plain, 0xC00B, times)
+            run_until(self.cpu, 0xC00B, times)
+            self.assertSameState(self.cpu, plain)
+        # $10 keeps changing, $11 wraps after 256 calls
+        self.assertEqual(self.memoizer.hits, 0)
+
+    def test_hits(self):
+        """Calls with the same registers and inputs come from the cache"""
+        self.cpu.load(0xD000, bytes([0xEA, 0xEA])) # No INC, so inputs repeat
+        self.cpu.load(0xD010, bytes([0x24, 0x11])) # BIT $11, no DEC
+        plain = make_cpu(*BLOCKS)
+        plain.load(0xD000, bytes([0xEA, 0xEA]))
+        plain.load(0xD010, bytes([0x24, 0x11]))
+
+        run_until(plain, 0xC00B, 10)
+        run_until(self.cpu, 0xC00B, 10)
+        self.assertSameState(self.cpu, plain)
+        self.assertEqual(self.memoizer.misses, 4)  # Two per call site
+        self.assertEqual(self.memoizer.hits, 26)
+
+    def test_code_change(self):
+        """Changing a routine's code drops its cached results"""
+        self.cpu.load(0xD000, bytes([0xEA, 0xEA]))
+        run_until(self.cpu, 0xC00B, 3)
+        self.assertEqual(self.cpu.Y, 7)
+        self.cpu.memory[0xD008] = 0x09             # LDY #$09
+        run_until(self.cpu, 0xC005, 1)
+        self.assertEqual(self.cpu.Y, 9)
+
+    def test_io(self):
+        """Routines that touch I/O registers are never cached"""
+        self.cpu.load(0xD010, bytes([0x8D, 0x00, 0x20, 0x60])) # STA $2000
+        run_until(self.cpu, 0xC00B, 3)
+        self.assertIn(0xD010, self.memoizer.impure)
+        self.assertIn(0xD000, self.memoizer.impure) # Calls D010
+        self.assertEqual(self.memoizer.hits, 0)
+
+    def test_detach(self):
+        """Detaching restores the CPU's own step"""
+        self.memoizer.detach()
+        self.assertEqual(self.cpu.step.__func__, CPU.step)
+
+    def test_stacked_detach(self):
+        """Detaching leaves a coverage map attached underneath recording"""
+        from coverage_map import CoverageMap
+        self.memoizer.detach()
+        coverage = CoverageMap()
+        coverage.attach(self.cpu)
+        self.memoizer.attach(self.cpu)
+        with self.assertRaises(RuntimeError):
+            coverage.detach()
+        self.memoizer.detach()
+        self.cpu.run(3)
+        self.assertEqual(coverage.summary()[0], 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,10 @@
 import unittest
 from cpu import *
 from gamepak import *
+from superinstructions import Superinstructions, profile, choose
+from testing import CPUTestCase, make_cpu
 
-class TestNES(unittest.TestCase):
+class TestNES(CPUTestCase):
     def test_cpu(self):
         """Tests for correctness of the CPU and its instructions by comparing
         against logs from known working emulators"""
@@ -36,25 +38,7 @@ class TestNES(unittest.TestCase):
                         cmp_value = int(first_byte + second_byte, 16)
                         self.assertEqual(info.value, cmp_value)
 
-                    # A register
-                    cmp_a = int(line[50:52], 16)
-                    self.assertEqual(cpu.A, cmp_a)
-
-                    # X register
-                    cmp_x = int(line[55:57], 16)
-                    self.assertEqual(cpu.X, cmp_x)
-
-                    # Y register
-                    cmp_y = int(line[60:62], 16)
-                    self.assertEqual(cpu.Y, cmp_y)
-
-                    # Status register
-                    cmp_p = int(line[65:67], 16)
-                    self.assertEqual(cpu.P, cmp_p)
-
-                    # Stack pointer
-                    cmp_sp = int(line[71:73], 16)
-                    self.assertEqual(cpu.SP, cmp_sp)
+                    self.assertRegisters(cpu, line)
 
                     # CPU Cycle
                     # cmp_cyc = int(line[78:81], 10)
@@ -76,5 +60,44 @@ class TestNES(unittest.TestCase):
                 e.args += line[0:8],
                 raise
 
+    def test_superinstructions(self):
+        """Runs nestest with fused instructions, checking the state against
+        the log whenever a fused sequence finishes"""
+        cpu  = CPU()
+        game = GamePak('test/nestest.nes')
+        for bank in range(0x8000, 0x10000, len(game.prg_rom)):
+            cpu.load(bank, game.prg_rom)
+        plain = CPU()
+        plain.memory[:] = cpu.memory
+
+        # Fuse the sequences nestest itself runs most, as the shipped table
+        # was generated from a different program
+        counts = profile(make_cpu((0, plain.memory)), 1000)
+        fused = Superinstructions([s for s, count in choose(counts)])
+        fused.attach(cpu)
+
+        with open('test/nestest.log') as f:
+            lines = f.readlines()
+        line = fused_count = 0
+        try:
+            while line < len(lines):
+                self.assertEqual(cpu.PC, int(lines[line][0:4], 16))
+                self.assertRegisters(cpu, lines[line])
+                self.assertEqual(cpu.cycle, plain.cycle)
+                self.assertEqual(cpu.memory, plain.memory)
+
+                # Fused sequences skip the log lines of all but their first
+                # instruction
+                count = fused.execute(cpu)
+                for _ in range(count):
+                    plain.step(plain.fetch())
+                line += count
+                fused_count += count > 1
+        except TypeError:
+            # Stops on the same incomplete instruction as test_cpu
+            pass
+        self.assertGreater(line, 400)
+        self.assertGreater(fused_count, 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+try:
+    import numpy as np
+    from renderer import *
+except ImportError:
+    np = None
+from gamepak import *
+
+@unittest.skipIf(np is None, "renderer needs numpy")
+class TestRenderer(unittest.TestCase):
+    def setUp(self):
+        self.game = GamePak('test/nestest.nes')
+        self.renderer = Renderer(self.game.chr_rom)
+
+    def test_decode(self):
+        """Vectorized decoding matches decoding one pixel at a time"""
+        atlas = self.renderer.atlas()
+        chr_rom = self.game.chr_rom
+        for tile in (0, 0x41, 0x1FF):
+            for y in range(8):
+                for x in range(8):
+                    low  = chr_rom[tile * 16 + y] >> (7 - x) & 1
+                    high = chr_rom[tile * 16 + 8 + y] >> (7 - x) & 1
+                    self.assertEqual(atlas[tile, y, x], low | high << 1)
+
+    def test_cache(self):
+        """An unchanged bank is only decoded once"""
+        self.assertIs(self.renderer.atlas(), self.renderer.atlas())
+        self.assertEqual(len(self.renderer.atlases), 1)
+
+    def test_cache_chr_ram(self):
+        """Changing CHR RAM replaces the bank's atlas instead of adding one"""
+        chr_ram = bytearray(BANK_SIZE)
+        renderer = Renderer(chr_ram)
+        for i in range(50):
+            chr_ram[0] = i
+            self.assertEqual(renderer.atlas()[0, 0, 7], i & 1)
+        self.assertEqual(len(renderer.atlases), 1)
+
+    def test_missing_bank(self):
+        """Cartridges without CHR ROM raise a clear error"""
+        with self.assertRaises(ValueError):
+            Renderer(b'').pattern_table(0)
+
+    def test_nametable(self):
+        """Tiles are drawn in place with the palette from the attributes"""
+        nametable = bytearray(1024)
+        nametable[35] = 0x41       # Tile (3, 1) is 'A'
+        nametable[960] = 0b1100    # Palette 3 for the top right of area 0
+        palette_ram = bytes(range(32))
+        frame = self.renderer.nametable(nametable, palette_ram=palette_ram)
+        self.assertEqual(frame.shape, (240, 256, 3))
+
+        tile = self.renderer.atlas()[0x41]
+        expected = np.where(tile == 0, 0, 12 + tile)
+        region = frame[8:16, 24:32]
+        self.assertTrue((region == SYSTEM_PALETTE[expected]).all())
+
+        nametable[960] = 0b0100    # Palette 1
+        frame = self.renderer.nametable(nametable, palette_ram=palette_ram)
+        expected = np.where(tile == 0, 0, 4 + tile)
+        self.assertTrue((frame[8:16, 24:32] == SYSTEM_PALETTE[expected]).all())
+
+    def test_write_png(self):
+        """Frames are written as PNG with the right dimensions"""
+        import tempfile, os, struct
+        frame = self.renderer.pattern_table(1)
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'table.png')
+            write_frame(filename, frame)
+            with open(filename, 'rb') as f:
+                data = f.read()
+        self.assertEqual(data[:8], b'\x89PNG\r\n\x1a\n')
+        self.assertEqual(struct.unpack('>II', data[16:24]), (128, 128))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import io, unittest
+from unittest import mock
+from cpu import *
+from shared import *
+import main
+
+class TestShared(unittest.TestCase):
+    def setUp(self):
+        self.shared = SharedState()
+        self.reader = SharedStateReader(self.shared.name)
+        self.cpu = CPU(self.shared.memory)
+
+    def tearDown(self):
+        self.reader.close()
+        self.shared.close()
+
+    def test_memory(self):
+        """Writes by the CPU are visible to readers without publishing"""
+        self.cpu.step(Info(0xA9, 2, b'\x42', 'little')) # LDA #$42
+        self.cpu.step(Info(0x48, 1, b'', 'little'))     # PHA
+        self.cpu.step(Info(0x8D, 3, b'\x00\x02', 'little')) # STA $0200
+        self.assertEqual(self.reader.memory[0x200], 0x42)
+        self.assertEqual(self.reader.stack[0xFD], 0x42)
+        with self.assertRaises(TypeError):
+            self.reader.memory[0x200] = 0
+
+    def test_registers(self):
+        """Registers are visible once published, and stale while running"""
+        self.cpu.step(Info(0xA2, 2, b'\x07', 'little')) # LDX #$07
+        self.shared.publish(self.cpu)
+        registers = self.reader.registers()
+        self.assertEqual(registers['X'], 7)
+        self.assertEqual(registers['PC'], 0xC002)
+        self.assertEqual(registers['cycle'], 2)
+
+        self.shared.begin()
+        with self.assertRaises(TimeoutError):
+            self.reader.snapshot(retries=3)
+
+    @unittest.skipIf(UNTRACKED or TRACKER_PREFIX is None,
+                     "readers are not tracked")
+    def test_same_process_reader(self):
+        """Readers leave the tracker entry of a block created by this
+        process to its SharedState"""
+        with mock.patch('shared.resource_tracker.unregister') as unregister:
+            SharedStateReader(self.shared.name).close()
+        unregister.assert_not_called()
+
+class TestSharedMain(unittest.TestCase):
+    def test_close_on_eof(self):
+        """The shared block is removed when the REPL ends with Ctrl-D"""
+        with mock.patch('builtins.input', side_effect=EOFError), \
+                mock.patch('sys.stdout', io.StringIO()):
+            with self.assertRaises(EOFError):
+                main.main(shared_name='v6502_test_eof')
+        with self.assertRaises(FileNotFoundError):
+            SharedStateReader('v6502_test_eof')
+
+if __name__ == '__main__':
+    unittest.main()
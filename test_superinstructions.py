@@ -0,0 +1,124 @@
+import os, tempfile, unittest
+from cpu import *
+from coverage_map import CoverageMap, check_address
+from superinstructions import *
+from testing import CPUTestCase, make_cpu
+
+# Copies X into $0300-$03FF, then loops forever
+PROGRAM = bytes([0xA2, 0x00,         # C000 LDX #$00
+                 0x8A,               # C002 TXA
+                 0x8D, 0x00, 0x03,   # C003 STA $0300
+                 0xEE, 0x04, 0xC0,   # C006 INC $C004
+                 0xE8,               # C009 INX
+                 0xE0, 0x00,         # C00A CPX #$00
+                 0xD0, 0xF4,         # C00C BNE $C002
+                 0x4C, 0x00, 0xC0])  # C00E JMP $C000
+
+SEQUENCES = [(0x8A, 0x8D), (0x8D, 0xEE), (0xE8, 0xE0, 0xD0), (0xA2, 0x8A, 0x8D)]
+
+BLOCKS = ((0xC000, PROGRAM),)
+
+class TestSuperinstructions(CPUTestCase):
+    def setUp(self):
+        self.cpu = make_cpu(*BLOCKS)
+        self.fused = Superinstructions(SEQUENCES)
+        self.fused.attach(self.cpu)
+
+    def test_run(self):
+        """Fused and plain runs agree, including on self-modified code"""
+        plain = make_cpu(*BLOCKS)
+        for count in (1, 2, 3, 7, 100, 1000, 5000):
+            self.assertEqual(self.cpu.run(count), plain.run(count))
+            self.assertSameState(self.cpu, plain)
+        self.assertEqual(self.cpu.memory[0x3FF], 0xFF)
+
+    def test_decode(self):
+        """The longest safe sequence is fused"""
+        memory = self.cpu.memory
+        self.assertEqual(self.fused.decode(memory, 0xC009).count, 3)
+        self.assertEqual(self.fused.decode(memory, 0xC002).count, 2)
+        self.assertEqual(self.fused.decode(memory, 0xC003).count, 2)
+        self.assertEqual(self.fused.decode(memory, 0xC00E).count, 1)
+
+        # The STA would overwrite the code of the sequence
+        memory[0xC004:0xC006] = bytes([0x07, 0xC0])
+        self.assertEqual(self.fused.decode(memory, 0xC003).count, 1)
+
+        # So could an indexed STA, depending on X
+        cpu, plain = make_cpu(), make_cpu()
+        for c in (cpu, plain):
+            c.load(0xC000, bytes([0x9D, 0x03, 0xC0,  # STA $C003,X
+                                  0xA9, 0x11]))      # LDA #$11
+            c.A, c.X = 0x77, 1
+        fused = Superinstructions([(0x9D, 0xA9)])
+        self.assertEqual(fused.decode(cpu.memory, 0xC000).count, 1)
+        fused.attach(cpu)
+        cpu.run(2)
+        plain.run(2)
+        self.assertSameState(cpu, plain)
+        self.assertEqual(cpu.A, 0x77)
+
+    def test_code_change(self):
+        """Cached instructions are decoded again when their code changes"""
+        self.cpu.run(3)
+        self.cpu.memory[0xC003] = 0x8E  # STX $0300
+        self.cpu.PC = 0xC002
+        self.assertEqual(self.fused.execute(self.cpu), 1)
+        self.assertEqual(self.fused.lookup(self.cpu).code, bytes([0x8E, 0x00, 0x03]))
+
+    def test_default_table(self):
+        """The shipped table fuses the hot loops it was generated from"""
+        fused = Superinstructions()
+        for sequence in ((0xA9, 0x8D), (0xC9, 0xD0), (0xCA, 0xD0),
+                         (0xE8, 0xE0, 0xD0)):
+            self.assertIn(sequence, fused.sequences)
+
+        with open(os.path.join("programs", "hotloops.bin"), "rb") as f:
+            blocks = ((0xC000, f.read()),)
+        for blocks in (blocks, BLOCKS):
+            cpu, plain = make_cpu(*blocks), make_cpu(*blocks)
+            Superinstructions().attach(cpu)
+            self.assertEqual(cpu.run(5000), plain.run(5000))
+            self.assertSameState(cpu, plain)
+
+    def test_wrapped_step(self):
+        """CPUs with a wrapped step run one instruction at a time"""
+        seen = []
+        step = self.cpu.step
+        def counted_step(info):
+            seen.append(info.opcode)
+            step(info)
+        self.cpu.step = counted_step
+        self.cpu.run(10)
+        self.assertEqual(len(seen), 10)
+
+    def test_profile(self):
+        """Profiles count fall-through sequences and regenerate the table"""
+        counts = profile(make_cpu(*BLOCKS), 1000)
+        self.assertEqual(counts[(0xE8, 0xE0, 0xD0)], 166)
+        self.assertEqual(counts[(0xD0, 0x8A)], 0)  # BNE ends a sequence
+        chosen = choose(counts, 4)
+        self.assertEqual(len(chosen), 4)
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "table.py")
+            write_table(filename, chosen, ["test.nes"])
+            table = {}
+            with open(filename) as f:
+                exec(f.read(), table)
+        self.assertEqual(table['SEQUENCES'], chosen)
+
+    def test_profile_wrapped(self):
+        """Profiling keeps step wrappers that were already attached"""
+        coverage = CoverageMap()
+        coverage.attach(self.cpu)
+        profile(self.cpu, 10)
+        coverage.executed[:] = bytes(len(coverage.executed))
+        pc = self.cpu.PC
+        self.cpu.run(1)
+        self.assertTrue(check_address(coverage.executed, pc))
+        coverage.detach()
+        self.assertNotIn('step', vars(self.cpu))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+"""Helpers shared by the CPU tests"""
+import unittest
+from cpu import *
+
+
+def make_cpu(*blocks):
+    """Returns a CPU with each (address, data) block loaded into memory"""
+    cpu = CPU()
+    for address, data in blocks:
+        cpu.load(address, data)
+    return cpu
+
+
+class CPUTestCase(unittest.TestCase):
+    """A TestCase with assertions about CPU state"""
+    def assertSameState(self, a, b):
+        """Checks that two CPUs have the same registers, cycle count and
+        memory"""
+        self.assertEqual((a.A, a.X, a.Y, a.P, a.SP, a.PC, a.cycle),
+                         (b.A, b.X, b.Y, b.P, b.SP, b.PC, b.cycle))
+        self.assertEqual(a.memory, b.memory)
+
+    def assertRegisters(self, cpu, line):
+        """Compares the CPU's registers with a line of nestest.log"""
+        # A register
+        cmp_a = int(line[50:52], 16)
+        self.assertEqual(cpu.A, cmp_a)
+
+        # X register
+        cmp_x = int(line[55:57], 16)
+        self.assertEqual(cpu.X, cmp_x)
+
+        # Y register
+        cmp_y = int(line[60:62], 16)
+        self.assertEqual(cpu.Y, cmp_y)
+
+        # Status register
+        cmp_p = int(line[65:67], 16)
+        self.assertEqual(cpu.P, cmp_p)
+
+        # Stack pointer
+        cmp_sp = int(line[71:73], 16)
+        self.assertEqual(cpu.SP, cmp_sp)